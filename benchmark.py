@@ -0,0 +1,348 @@
+"""
+Reproducible throughput benchmarks for the playground scripts.
+
+Generates deterministic synthetic inputs (scan-laden PCAPs, CLF logs with a
+controllable client ip distribution, PDFs with many objects and XMP streams,
+and large text corpora), runs the hot path of each script over them and
+reports throughput, peak RSS and the min/median/max run times as JSON, so
+results can be compared across commits:
+
+    python benchmark.py -o before.json
+    git checkout <other commit>
+    python benchmark.py -o after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Ip address whose log lines are searched by the log benchmarks
+TARGET_IP = '10.0.0.1'
+
+def generate_pcap(path, packets, seed, scanners=4, hosts=2000):
+    """Writes a classic libpcap Ethernet capture of TCP handshakes, with
+       scanners sending unanswered SYNs to random hosts and ports
+
+       Parameters:
+           path(str): Output file
+           packets(int): Approximate number of packets
+           seed(int): Random seed
+           scanners(int): Number of scanning hosts
+           hosts(int): Number of legitimate client hosts
+    """
+    rng = random.Random(seed)
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+
+        def write(timestamp, source, destination, flags):
+            tcp = struct.pack('>HHIIBBHHH', rng.randrange(1024, 65535), rng.randrange(1, 1024),
+                              rng.getrandbits(32), 0, 5 << 4, flags, 65535, 0, 0)
+            ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0, 64, 6, 0,
+                             source.to_bytes(4, 'big'), destination.to_bytes(4, 'big'))
+            frame = b'\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb\x08\x00' + ip + tcp
+            seconds = int(timestamp)
+            file.write(struct.pack('<IIII', seconds, int((timestamp - seconds) * 1e6), len(frame), len(frame)))
+            file.write(frame)
+
+        timestamp = 1600000000.0
+        written = 0
+        while written < packets:
+            timestamp += rng.expovariate(1000)
+            server = 0x0A000000 | rng.randrange(1, 256)
+            if rng.random() < 0.3:
+                write(timestamp, 0xC0A80000 | rng.randrange(scanners), server, 0x02)
+                written += 1
+            else:
+                client = 0xAC100000 | rng.randrange(hosts)
+                write(timestamp, client, server, 0x02)
+                write(timestamp, server, client, 0x12)
+                write(timestamp, client, server, 0x10)
+                written += 3
+
+def generate_log(path, lines, seed, hosts=5000, skew=1.2):
+    """Writes a combined format CLF log whose client ips follow a Zipf-like
+       distribution over hosts addresses. TARGET_IP is the most frequent one
+
+       Parameters:
+           path(str): Output file
+           lines(int): Number of log lines
+           seed(int): Random seed
+           hosts(int): Number of distinct client ips
+           skew(float): Zipf exponent, 0 gives a uniform distribution
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank ** skew) for rank in range(1, hosts + 1)]
+    addresses = ['10.{}.{}.{}'.format(rank >> 16 & 255, rank >> 8 & 255, rank & 255) for rank in range(1, hosts + 1)]
+    months = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+    with open(path, 'w') as file:
+        for line, ip in enumerate(rng.choices(addresses, weights, k=lines)):
+            seconds = line // 10
+            file.write('{} - - [{:02d}/{}/2021:{:02d}:{:02d}:{:02d} +0000] "GET /page/{} HTTP/1.1" {} {} '
+                       '"https://example.com/" "Mozilla/5.0 (X11; Linux x86_64)"\n'.format(
+                           ip, 1 + seconds // 86400 % 28, months[seconds // 2419200 % 12],
+                           seconds // 3600 % 24, seconds // 60 % 60, seconds % 60,
+                           rng.randrange(10000), rng.choice((200, 200, 200, 304, 404, 500)), rng.randrange(100000)))
+
+def generate_pdf(path, objects, seed, xmp_streams=4):
+    """Writes a PDF with many small objects, an /Info dictionary and XMP
+       metadata streams, with a valid xref table
+
+       Parameters:
+           path(str): Output file
+           objects(int): Number of filler objects
+           seed(int): Random seed
+           xmp_streams(int): Number of XMP metadata streams
+    """
+    rng = random.Random(seed)
+
+    # Object numbers: catalog, info, XMP streams, pages, page per stream, fillers
+    info = 2
+    streams = range(3, 3 + xmp_streams)
+    pages = 3 + xmp_streams
+    page_objects = range(pages + 1, pages + 1 + xmp_streams)
+
+    bodies = ['<< /Type /Catalog /Pages {} 0 R /Metadata {} 0 R >>'.format(pages, streams[0]).encode(),
+              b'<< /Title (Synthetic) /Author (benchmark) /Producer (benchmark.py) >>']
+    for _ in streams:
+        history = ''.join(
+            '<rdf:li rdf:parseType="Resource"><stEvt:action>saved</stEvt:action>'
+            '<stEvt:instanceID>uuid:{:032x}</stEvt:instanceID>'
+            '<stEvt:when>2021-01-{:02d}T10:00:00Z</stEvt:when></rdf:li>\n'.format(rng.getrandbits(128), day)
+            for day in range(1, 11))
+        packet = ('<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+                  '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+                  '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+                  '<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/" '
+                  'xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/" '
+                  'xmlns:stEvt="http://ns.adobe.com/xap/1.0/sType/ResourceEvent#" '
+                  'xmlns:pdf="http://ns.adobe.com/pdf/1.3/" xmp:CreatorTool="benchmark">\n'
+                  '<xmp:CreateDate>2021-01-01T10:00:00Z</xmp:CreateDate>\n'
+                  '<xmp:ModifyDate>2021-01-10T10:00:00Z</xmp:ModifyDate>\n'
+                  '<xmpMM:DocumentID>uuid:{:032x}</xmpMM:DocumentID>\n'
+                  '<pdf:Producer>benchmark.py</pdf:Producer>\n'
+                  '<xmpMM:History><rdf:Seq>\n{}</rdf:Seq></xmpMM:History>\n'
+                  '</rdf:Description>\n</rdf:RDF>\n</x:xmpmeta>\n'
+                  '<?xpacket end="w"?>'.format(rng.getrandbits(128), history)).encode()
+        bodies.append(b'<< /Length ' + str(len(packet)).encode() + b' /Subtype /XML /Type /Metadata >>stream\n'
+                      + packet + b'\nendstream')
+    kids = ' '.join('{} 0 R'.format(number) for number in page_objects)
+    bodies.append('<< /Type /Pages /Kids [{}] /Count {} >>'.format(kids, xmp_streams).encode())
+    for stream in streams:
+        bodies.append('<< /Type /Page /Parent {} 0 R /Metadata {} 0 R >>'.format(pages, stream).encode())
+    for number in range(objects):
+        bodies.append('<< /Type /Filler /Index {} /Value ({:x}) >>'.format(number, rng.getrandbits(64)).encode())
+
+    with open(path, 'wb') as file:
+        file.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(bodies, 1):
+            offsets.append(file.tell())
+            file.write(str(number).encode() + b' 0 obj\n' + body + b'\nendobj\n')
+        xref = file.tell()
+        file.write('xref\n0 {}\n0000000000 65535 f \n'.format(len(bodies) + 1).encode())
+        for offset in offsets:
+            file.write('{:010d} 00000 n \n'.format(offset).encode())
+        file.write('trailer\n<< /Size {} /Root 1 0 R /Info {} 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+            len(bodies) + 1, info, xref).encode())
+
+def generate_text(path, size, seed):
+    """Writes an English-like text corpus of about size bytes
+
+       Parameters:
+           path(str): Output file
+           size(int): Approximate size in bytes
+           seed(int): Random seed
+    """
+    rng = random.Random(seed)
+    words = ('the of and to in is was that for it with as his on be at by had are but from or have an they '
+             'which one you were all her she there would their we him been has when who will no more if out '
+             'so said what up its about than into them can only other time new some could these two may first '
+             'then do any like my now over such our man me even most made after also did many before must '
+             'through back years where much your way well down should because each just those people Mr how too '
+             'little state good very make world still own see men work long get here between both life being '
+             'under never day same another know while last might us great old year off come since against go came '
+             'right used take three 2021 42 1984').split()
+    with open(path, 'w') as file:
+        written = 0
+        while written < size:
+            line = ' '.join(rng.choices(words, k=12)).capitalize() + '.\n'
+            file.write(line)
+            written += len(line)
+
+def run_pcap(path, fast):
+    from port_scan_detector import PacketAnalyzer
+    analyzer = PacketAnalyzer(path, 3, fast=fast)
+    analyzer.analyze_file(path)
+    return analyzer.packet_count
+
+def run_log(path, fast):
+    from log_parser import LogParser
+    count = 0
+    for line in LogParser(path, fast=fast, use_index=False).read_lines():
+        count += 1
+    for entry in LogParser(path, fast=fast, use_index=False).iter_ip(TARGET_IP):
+        str(entry)
+    return count
+
+def run_pdf(path):
+    from pdf_scraper import BinaryPdfForensics, XMPPacket
+    with BinaryPdfForensics(file_path=path) as forensics:
+        results = forensics.get_xmp_obj()[1]
+        forensics.get_info_obj()
+        for obj in results.values():
+            str(XMPPacket(obj))
+    return len(results)
+
+def run_caesar(path):
+    from caesar_cypher import EncryptionEngine
+    with open(path) as file:
+        text = file.read()
+    EncryptionEngine(text, 3).process()
+    return len(text)
+
+def run_caesar_stream(path):
+    from caesar_cypher import EncryptionEngine
+    with open(path, 'rb') as file, open(os.devnull, 'wb') as output:
+        return EncryptionEngine(shift_key=3).process_stream(file, output)
+
+# name -> (generator, size option, runner, runner arguments)
+BENCHMARKS = {
+    'pcap_dpkt': (generate_pcap, 'packets', run_pcap, (False,)),
+    'pcap_fast': (generate_pcap, 'packets', run_pcap, (True,)),
+    'log_search': (generate_log, 'log_lines', run_log, (False,)),
+    'log_search_fast': (generate_log, 'log_lines', run_log, (True,)),
+    'pdf_xmp': (generate_pdf, 'pdf_objects', run_pdf, ()),
+    'caesar': (generate_text, 'text_bytes', run_caesar, ()),
+    'caesar_stream': (generate_text, 'text_bytes', run_caesar_stream, ()),
+}
+
+def median(samples):
+    """Returns the median of a list of samples"""
+    ordered = sorted(samples)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+def measure(name, path, repeat):
+    """Runs a benchmark repeat times in the current process and returns its
+       result record. Called in a fresh process so peak RSS is per benchmark"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    _, _, runner, arguments = BENCHMARKS[name]
+    samples = []
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = runner(path, *arguments)
+        samples.append(time.perf_counter() - start)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    # Run times of whole runs; with a handful of samples only the extremes
+    # and the median are meaningful
+    middle = median(samples)
+    size = os.path.getsize(path)
+    return {'name': name,
+            'input_bytes': size,
+            'items': items,
+            'repeat': repeat,
+            'seconds': {'samples': len(samples), 'min': min(samples), 'median': middle, 'max': max(samples)},
+            'bytes_per_second': size / middle if middle else None,
+            'items_per_second': items / middle if middle else None,
+            'peak_rss_bytes': peak_rss}
+
+def git_commit():
+    """Returns the current git commit of the repository, or None"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """Prints the change in median latency against a previous report"""
+    with open(baseline_path) as file:
+        baseline = {result['name']: result for result in json.load(file)['results']}
+    for result in results:
+        before = baseline.get(result['name'])
+        if not before or 'seconds' not in before or 'seconds' not in result:
+            continue
+        # Reports written before the median was named kept it as p50
+        previous = before['seconds'].get('median', before['seconds'].get('p50'))
+        current = result['seconds']['median']
+        change = current / previous - 1
+        print("{:16} median {:9.4f}s -> {:9.4f}s ({:+.1%})".format(
+            result['name'], previous, current, change), file=sys.stderr)
+
+def main():
+    """Main program entry point"""
+
+    # Set up arguments
+    parser = argparse.ArgumentParser(description="Reproducible throughput benchmarks for the playground scripts")
+    parser.add_argument("-b", "--benchmark", help="Benchmark to run, may be repeated (default: all)",
+                        action='append', choices=sorted(BENCHMARKS))
+    parser.add_argument("-r", "--repeat", help="Timed runs per benchmark", type=int, default=5)
+    parser.add_argument("-s", "--seed", help="Random seed of the generated inputs", type=int, default=1)
+    parser.add_argument("--packets", help="Packets in the generated PCAP", type=int, default=200000)
+    parser.add_argument("--log-lines", help="Lines in the generated CLF log", type=int, default=200000)
+    parser.add_argument("--pdf-objects", help="Filler objects in the generated PDF", type=int, default=50000)
+    parser.add_argument("--text-bytes", help="Size of the generated text corpus", type=int, default=50 << 20)
+    parser.add_argument("-d", "--data-dir", help="Directory for generated inputs (default: temporary)")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("-c", "--compare", help="Previous JSON report to compare median latencies against")
+    args = parser.parse_args()
+
+    config = {'seed': args.seed, 'repeat': args.repeat, 'packets': args.packets, 'log_lines': args.log_lines,
+              'pdf_objects': args.pdf_objects, 'text_bytes': args.text_bytes}
+    names = args.benchmark or list(BENCHMARKS)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        os.makedirs(data_dir, exist_ok=True)
+
+        results = []
+        for name in names:
+            generator, size_option, _, _ = BENCHMARKS[name]
+
+            # Inputs are shared by benchmarks of the same generator and size
+            path = os.path.join(data_dir, '{}_{}_{}.bin'.format(generator.__name__, config[size_option], args.seed))
+            if not os.path.exists(path):
+                generator(path, config[size_option], args.seed)
+
+            # Fresh process per benchmark so peak RSS is not inherited
+            print("Running {}".format(name), file=sys.stderr)
+            with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+                try:
+                    results.append(executor.submit(measure, name, path, args.repeat).result())
+                except Exception as e:
+                    results.append({'name': name, 'error': '{}: {}'.format(type(e).__name__, e)})
+
+    report = {'commit': git_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'config': config,
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,44 @@
 Simple Python caesar cypher
 """
 import argparse
+import io
 import string
+import sys
+from functools import lru_cache
+from math import log
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ALPHABETS = (string.ascii_lowercase, string.ascii_uppercase, string.digits)
+# Size of the reads made when processing files and streams
+CHUNK_SIZE = 1 << 22
+
+# Relative frequencies of the letters a to z in English text
+ENGLISH_FREQUENCIES = (8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+                       6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074)
+LETTERS = 26
+LETTER_BYTES = tuple((bytes([ord('a') + letter]), bytes([ord('A') + letter])) for letter in range(LETTERS))
+
+@lru_cache(maxsize=None)
+def translation_tables(shift_key, alphabets=ALPHABETS):
+    """Returns the str and bytes translation tables of a shift key
+
+       The tables are built once per key and alphabet set and cached.
+
+       Parameters:
+          shift_key(int): Key to shift alphabet characters
+          alphabets(tuple): Alphabet characters to be included in the tables
+
+       Returns:
+          tables(tuple): A str.translate table and a bytes.translate table
+    """
+    joined_alphabets = ''.join(alphabets)
+    joined_shifted_alphabets = ''.join(alphabet[shift_key:] + alphabet[:shift_key] for alphabet in alphabets)
+    return (str.maketrans(joined_alphabets, joined_shifted_alphabets),
+            bytes.maketrans(joined_alphabets.encode('ascii'), joined_shifted_alphabets.encode('ascii')))
 
 class EncryptionEngine:
     """
@@ -16,29 +53,52 @@ class EncryptionEngine:
     Methods:
         process():
             Encrypts/decrypts text depending on shift_key supplied to class
+        process_bytes(data):
+            Encrypts/decrypts bytes without decoding them
+        process_stream(source, destination):
+            Encrypts/decrypts a binary stream chunk by chunk
         shift(alphabet):
             Creates a shifted copy of an alphabet
     """
-    def __init__(self, text, shift_key):
+    def __init__(self, text=None, shift_key=3):
         self.text = text
         self.shift_key = shift_key
         self.__alphabets = (string.ascii_lowercase, string.ascii_uppercase, string.digits)
 
     def process(self):
         """Returns encrypted/decrypted text depending on shift key supplied"""
-        # Create shifted alphabet based on shift key
-        shifted_alphabets = tuple(map(self.shift_alphabet, self.__alphabets))
-        
-        # Create alphabet strings needed to create encrytion table
-        joined_alphabets = ''.join(self.__alphabets)
-        joined_shifted_alphabets = ''.join(shifted_alphabets)
-
-        # Create encryption table by translating alphabet characters 
-        # to shifted characters 
-        table = str.maketrans(joined_alphabets, joined_shifted_alphabets)
+        # Encryption table translating alphabet characters to shifted
+        # characters, built once per key
+        table = translation_tables(self.shift_key, self.__alphabets)[0]
 
         # Encrypt/decrypt text
         return self.text.translate(table)
+
+    def process_bytes(self, data):
+        """Returns encrypted/decrypted bytes depending on shift key supplied
+
+           The alphabets are ASCII, so UTF-8 and other ASCII-compatible
+           encodings are translated correctly without being decoded.
+        """
+        return data.translate(translation_tables(self.shift_key, self.__alphabets)[1])
+
+    def process_stream(self, source, destination, chunk_size=CHUNK_SIZE):
+        """Encrypts/decrypts a binary stream into another in fixed-size chunks
+
+           Parameters:
+              source: Binary file object to read from
+              destination: Binary file object to write to
+              chunk_size(int): Number of bytes read at a time
+
+           Returns:
+              size(int): Number of bytes processed
+        """
+        table = translation_tables(self.shift_key, self.__alphabets)[1]
+        size = 0
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            destination.write(chunk.translate(table))
+            size += len(chunk)
+        return size
     
     def shift_alphabet(self, alphabet):
         """Returns a shifted alphabet based on the shift key supplied
@@ -52,18 +112,182 @@ class EncryptionEngine:
         """
         return alphabet[self.shift_key:] + alphabet[:self.shift_key]
 
+class CaesarCracker:
+    """
+    Recovers Caesar shift keys by letter frequency analysis
+
+    The ciphertext is reduced to a single histogram of its letters and
+    all 26 shifts are scored against a language model at once, as a
+    matrix product when numpy is available, so only the best candidate
+    keys are ever used to decrypt the text.
+
+    Attributes:
+        frequencies(list): Relative letter frequencies of the language
+        method(str): 'chi2' for chi-squared scores, 'loglik' for negated
+                     log-likelihood scores; lower scores are better
+
+    Methods:
+        histogram(data):
+            Counts the letters of a text
+        scores(counts):
+            Scores every shift of one or more histograms
+        crack(text, candidates):
+            Returns the most likely keys and decrypted texts
+        crack_many(messages):
+            Cracks a batch of messages in one pass
+    """
+    def __init__(self, frequencies=ENGLISH_FREQUENCIES, method='chi2'):
+        if method not in ('chi2', 'loglik'):
+            raise ValueError("Unknown scoring method: {}".format(method))
+        total = float(sum(frequencies))
+        self.frequencies = [frequency / total for frequency in frequencies]
+        self.method = method
+
+        # Row s is the expected ciphertext letter distribution of shift s
+        self._expected = [[self.frequencies[(letter - shift) % LETTERS] for letter in range(LETTERS)]
+                          for shift in range(LETTERS)]
+        if np is not None:
+            expected = np.array(self._expected)
+            self._weights = (np.log(expected) if method == 'loglik' else 1.0 / expected).T
+
+    def histogram(self, data):
+        """Returns the 26 case-folded letter counts of str or bytes data"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if np is not None:
+            counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+            return (counts[97:123] + counts[65:91]).tolist()
+        return [data.count(lower) + data.count(upper) for lower, upper in LETTER_BYTES]
+
+    def histograms(self, messages):
+        """Returns the letter counts of many messages, one row per message"""
+        encoded = [message.encode('utf-8') if isinstance(message, str) else message for message in messages]
+        if np is None:
+            return [self.histogram(message) for message in encoded]
+
+        # Count every message at once, binning letters by message index
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8) | 0x20
+        ids = np.repeat(np.arange(len(encoded)), [len(message) for message in encoded])
+        letters = (data >= 97) & (data <= 122)
+        bins = ids[letters] * LETTERS + (data[letters] - 97)
+        return np.bincount(bins, minlength=len(encoded) * LETTERS).reshape(len(encoded), LETTERS)
+
+    def scores(self, counts):
+        """Returns the score of each shift for one histogram, or a row of
+           scores per histogram for a list of histograms"""
+        single = len(counts) == LETTERS and not hasattr(counts[0], '__len__')
+        if np is not None:
+            matrix = np.atleast_2d(np.asarray(counts, dtype=float))
+            if self.method == 'loglik':
+                scores = -(matrix @ self._weights)
+            else:
+                # sum((O - N*f)^2 / (N*f)) expands to sum(O^2 / f) / N - N
+                totals = matrix.sum(axis=1, keepdims=True)
+                scores = (matrix ** 2 @ self._weights) / np.maximum(totals, 1) - totals
+            return scores[0].tolist() if single else scores
+
+        rows = [counts] if single else counts
+        scores = []
+        for row in rows:
+            total = sum(row)
+            if self.method == 'loglik':
+                scores.append([-sum(count * log(expected) for count, expected in zip(row, shift))
+                               for shift in self._expected])
+            else:
+                scores.append([sum(count * count / expected for count, expected in zip(row, shift)) / max(total, 1) - total
+                               for shift in self._expected])
+        return scores[0] if single else scores
+
+    def keys(self, counts, candidates=1):
+        """Returns the candidates most likely encryption keys of a histogram"""
+        scores = self.scores(counts)
+        return sorted(range(LETTERS), key=scores.__getitem__)[:candidates]
+
+    def crack(self, text, candidates=1):
+        """Returns [(key, decrypted text)] for the most likely keys, best first
+
+           Parameters:
+              text(str or bytes): Ciphertext
+              candidates(int): Number of keys to try
+        """
+        results = []
+        for key in self.keys(self.histogram(text), candidates):
+            engine = EncryptionEngine(text, -key)
+            results.append((key, engine.process_bytes(text) if isinstance(text, bytes) else engine.process()))
+        return results
+
+    def crack_many(self, messages):
+        """Returns [(key, decrypted message)] for a batch of messages
+
+           The histograms of all messages are counted and scored in one
+           pass, then each message is decrypted once with its best key.
+        """
+        scores = self.scores(self.histograms(messages))
+        if np is not None:
+            keys = np.argmin(scores, axis=1).tolist()
+        else:
+            keys = [min(range(LETTERS), key=row.__getitem__) for row in scores]
+        results = []
+        for message, key in zip(messages, keys):
+            engine = EncryptionEngine(message, -key)
+            results.append((key, engine.process_bytes(message) if isinstance(message, bytes) else engine.process()))
+        return results
+
 def main():
     """Main program entry point"""
     # Setup commandline paramenter
     parser = argparse.ArgumentParser(description="Simple caesar cypher")
-    parser.add_argument("-m", "--message", help="The string to encrypt", required=True, type=str)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-m", "--message", help="The string to encrypt", type=str)
+    source.add_argument("-i", "--input", help="File to encrypt, - for stdin", type=str)
+    parser.add_argument("-o", "--output", help="File to write the result of --input to, stdout by default", type=str)
     parser.add_argument("-k", "--key", help="Encryption shift key", type=int, default=3)
+    parser.add_argument("-x", "--crack", help="Recovers the key of the ciphertext and decrypts it", action='store_true')
+    parser.add_argument("-n", "--candidates", help="Number of candidate keys shown by --crack -m", type=int, default=1)
+    parser.add_argument("--method", help="Scoring used by --crack", choices=('chi2', 'loglik'), default='chi2')
+    parser.add_argument("-b", "--batch", help="With --crack, cracks each line of --input as a separate message", action='store_true')
 
     # Parse commandline arguments
     args = parser.parse_args()
 
     # Run encryption program and print result
-    print(EncryptionEngine(args.message, args.key).process())
+    cracker = CaesarCracker(method=args.method) if args.crack else None
+    if args.message is not None:
+        if cracker:
+            for key, plaintext in cracker.crack(args.message, args.candidates):
+                print("key {}: {}".format(key, plaintext))
+        else:
+            print(EncryptionEngine(args.message, args.key).process())
+        return
+
+    # Stream files and stdin through the bytes path
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    destination = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        if cracker and args.batch:
+            messages = source.read().decode('utf-8', 'replace').splitlines()
+            for key, plaintext in cracker.crack_many(messages):
+                destination.write("{}\t{}\n".format(key, plaintext).encode('utf-8'))
+        elif cracker:
+            # Count the letters in a first pass, then decrypt with the best key
+            if not source.seekable():
+                source = io.BytesIO(source.read())
+            counts = [0] * LETTERS
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                counts = [total + count for total, count in zip(counts, cracker.histogram(chunk))]
+            source.seek(0)
+            key = cracker.keys(counts)[0]
+            print("key {}".format(key), file=sys.stderr)
+            EncryptionEngine(shift_key=-key).process_stream(source, destination)
+        else:
+            EncryptionEngine(shift_key=args.key).process_stream(source, destination)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if destination is not sys.stdout.buffer:
+            destination.close()
+        else:
+            destination.flush()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,406 @@
+"""
+Compact MD5 IOC store.
+
+Converts the hash files scraped by web_scraper.py (ioc_data/*.txt, one hex
+MD5 per line) into a single deduplicated, sorted binary file of 16-byte
+digests that is memory-mapped for lookups, so membership tests take a
+couple of page reads instead of loading tens of millions of strings:
+
+    python hash_store.py --build
+    python hash_store.py -q 44d88612fea8a8f36de82e1278abb02f
+    python hash_store.py --check suspicious.exe
+
+Store layout, little-endian:
+
+    header    magic, digest count, Bloom filter bits, Bloom hash count
+    fan-out   65537 cumulative counts of digests by 2-byte prefix
+    bloom     optional Bloom filter, padded to 16 bytes
+    digests   sorted 16-byte MD5 digests
+"""
+
+import argparse
+import binascii
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STORE_MAGIC = b'IOCMD5\x00\x01'
+STORE_HEADER = struct.Struct('<8sQQB7x')
+FANOUT_SIZE = (1 << 16) + 1
+FANOUT = struct.Struct('<%dQ' % FANOUT_SIZE)
+DIGEST_SIZE = 16
+SOURCES_SUFFIX = '.sources.json'
+MASK64 = (1 << 64) - 1
+HEX_PATTERN = re.compile(rb'[0-9a-fA-F]{32}')
+
+# Number of digests sorted in memory at a time while building
+RUN_DIGESTS = 1 << 22
+READ_SIZE = 1 << 20
+
+
+def iter_digest_blocks(file_path):
+    """Yields the MD5 digests of a hash file, concatenated in blocks
+
+    Lines that are not 32-character hex strings, such as comments, are
+    skipped.
+    """
+    with open(file_path, 'rb') as file:
+        while True:
+            lines = file.readlines(READ_SIZE)
+            if not lines:
+                break
+            tokens = [token for token in b''.join(lines).split() if len(token) == 32]
+            try:
+                yield binascii.unhexlify(b''.join(tokens))
+            except binascii.Error:
+                yield binascii.unhexlify(b''.join(token for token in tokens if HEX_PATTERN.fullmatch(token)))
+
+
+def parse_digest(value):
+    """Returns the 16-byte digest of a hex MD5 string or of a digest
+
+    Raises:
+        ValueError: If value is not an MD5 hash.
+    """
+    if isinstance(value, (bytes, bytearray)) and len(value) == DIGEST_SIZE:
+        return bytes(value)
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('ascii', 'replace')
+    value = value.strip()
+    if len(value) != 32:
+        raise ValueError("Not an MD5 hash: {}".format(value))
+    return bytes.fromhex(value)
+
+
+def sort_unique(buffer):
+    """Returns the sorted, deduplicated digests of a concatenated buffer"""
+    if np is not None:
+        return np.unique(np.frombuffer(bytes(buffer), dtype='V16')).tobytes()
+    view = bytes(buffer)
+    return b''.join(sorted({view[i:i + DIGEST_SIZE] for i in range(0, len(view), DIGEST_SIZE)}))
+
+
+def iter_records(file, start=0, end=None):
+    """Yields the 16-byte records of a file object between two offsets"""
+    file.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        size = READ_SIZE if remaining is None else min(READ_SIZE, remaining)
+        block = file.read(size)
+        if not block:
+            break
+        if remaining is not None:
+            remaining -= len(block)
+        for offset in range(0, len(block) - DIGEST_SIZE + 1, DIGEST_SIZE):
+            yield block[offset:offset + DIGEST_SIZE]
+
+
+def bloom_positions(digest, bits, hashes):
+    """Returns the Bloom filter bit positions of a digest
+
+    The digest is already uniformly distributed, so its two halves
+    serve as the two base hashes of double hashing.
+    """
+    first = int.from_bytes(digest[:8], 'little')
+    second = int.from_bytes(digest[8:], 'little') | 1
+    return [((first + i * second) & MASK64) % bits for i in range(hashes)]
+
+
+def build_bloom(body_file, count, bits_per_digest, hashes):
+    """Builds the Bloom filter of the digests in body_file
+
+    Returns:
+        A tuple (filter bytes, number of bits).
+    """
+    bits = max(64, (count * bits_per_digest + 63) // 64 * 64)
+    bloom = bytearray(bits // 8)
+    if np is not None:
+        array = np.frombuffer(bloom, dtype=np.uint8)
+        body_file.seek(0)
+        while True:
+            block = body_file.read(READ_SIZE)
+            if not block:
+                break
+            halves = np.frombuffer(block, dtype='<u8').reshape(-1, 2)
+            first, second = halves[:, 0], halves[:, 1] | np.uint64(1)
+            for i in range(hashes):
+                positions = (first + np.uint64(i) * second) % np.uint64(bits)
+                np.bitwise_or.at(array, (positions >> np.uint64(3)).astype(np.intp),
+                                 (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+    else:
+        for digest in iter_records(body_file):
+            for position in bloom_positions(digest, bits, hashes):
+                bloom[position >> 3] |= 1 << (position & 7)
+    return bytes(bloom), bits
+
+
+class HashStore:
+    """
+    Memory-mapped, read-only view of a store built by build_store()
+
+    Lookups narrow the search to the digests sharing the first two
+    bytes through the fan-out table, then binary search them in place,
+    so no digest is ever loaded into a Python container.
+
+    Attributes:
+        store_path(string): Path of the store file
+        count(int): Number of digests in the store
+        bloom_bits(int): Size of the Bloom filter in bits, 0 if there is none
+        bloom_hashes(int): Number of Bloom filter hash functions
+    """
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self._file = open(store_path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("Empty hash store: {}".format(store_path))
+
+        magic, self.count, self.bloom_bits, self.bloom_hashes = STORE_HEADER.unpack_from(self._data)
+        if magic != STORE_MAGIC:
+            self.close()
+            raise ValueError("Not a hash store: {}".format(store_path))
+        self._fanout_offset = STORE_HEADER.size
+        self._bloom_offset = self._fanout_offset + FANOUT.size
+        bloom_size = self.bloom_bits // 8
+        self._digest_offset = self._bloom_offset + (bloom_size + DIGEST_SIZE - 1) // DIGEST_SIZE * DIGEST_SIZE
+        if self._digest_offset + self.count * DIGEST_SIZE > len(self._data):
+            self.close()
+            raise ValueError("Truncated hash store: {}".format(store_path))
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._file.close()
+            self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, value):
+        return self.contains(value)
+
+    def contains(self, value):
+        """Returns whether a hex MD5 string or 16-byte digest is in the store"""
+        digest = parse_digest(value)
+        data = self._data
+
+        if self.bloom_bits:
+            for position in bloom_positions(digest, self.bloom_bits, self.bloom_hashes):
+                if not data[self._bloom_offset + (position >> 3)] & (1 << (position & 7)):
+                    return False
+
+        prefix = digest[0] << 8 | digest[1]
+        low, high = struct.unpack_from('<2Q', data, self._fanout_offset + prefix * 8)
+        base = self._digest_offset
+        while low < high:
+            middle = (low + high) // 2
+            offset = base + middle * DIGEST_SIZE
+            record = data[offset:offset + DIGEST_SIZE]
+            if record < digest:
+                low = middle + 1
+            elif record > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def lookup(self, values):
+        """Yields (value, found) for each hex MD5 string or digest;
+           values that are not MD5 hashes are reported as not found"""
+        for value in values:
+            try:
+                yield value, self.contains(value)
+            except ValueError:
+                yield value, False
+
+    def iter_digests(self):
+        """Yields the stored digests in sorted order"""
+        return iter_records(self._file, self._digest_offset, self._digest_offset + self.count * DIGEST_SIZE)
+
+
+def list_sources(directory):
+    """Returns {name: [size, mtime_ns]} for the hash files of a directory"""
+    sources = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.txt'):
+            stat = os.stat(os.path.join(directory, name))
+            sources[name] = [stat.st_size, stat.st_mtime_ns]
+    return sources
+
+
+def build_store(directory='ioc_data/', store_path=None, bloom_bits=0, bloom_hashes=7,
+                incremental=True, run_digests=RUN_DIGESTS):
+    """Builds the hash store of the hash files in a directory
+
+    Hash files are parsed into sorted runs of at most run_digests
+    digests in temporary files, which are merged and deduplicated in a
+    single streaming pass, so memory use does not grow with the number
+    of hashes. The source files are recorded next to the store; new
+    files and files that grew since the last build, e.g. by a resumed
+    download, are parsed and merged into the existing store, whose
+    deduplication drops the digests it already holds. A removed or
+    shrunk file triggers a full rebuild, as its digests may have to
+    leave the store.
+
+    Args:
+        directory: Directory of the scraped *.txt hash files.
+        store_path: Path of the store, hashes.bin in directory by default.
+        bloom_bits: Bloom filter bits per digest, 0 for no filter.
+        bloom_hashes: Number of Bloom filter hash functions.
+        incremental: Whether to reuse the existing store.
+        run_digests: Number of digests sorted in memory at a time.
+
+    Returns:
+        The number of hash files parsed, 0 if the store was up to date.
+    """
+    store_path = store_path or os.path.join(directory, 'hashes.bin')
+    sources_path = store_path + SOURCES_SUFFIX
+    sources = list_sources(directory)
+
+    previous = None
+    if incremental and os.path.exists(store_path) and os.path.exists(sources_path):
+        with open(sources_path) as file:
+            recorded = json.load(file)
+        if recorded.get('bloom') == [bloom_bits, bloom_hashes] and \
+                all(name in sources and sources[name][0] >= size for name, (size, _) in recorded['sources'].items()):
+            previous = recorded['sources']
+    new_files = [name for name in sources if previous is None or previous.get(name) != sources[name]]
+    if previous is not None and not new_files:
+        return 0
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(store_path))) as temp_dir:
+        # Sort the digests of new and grown files into runs
+        runs = []
+        buffer = bytearray()
+
+        def flush():
+            run_path = os.path.join(temp_dir, 'run{}'.format(len(runs)))
+            with open(run_path, 'wb') as run:
+                run.write(sort_unique(buffer))
+            runs.append(run_path)
+            buffer.clear()
+
+        for name in new_files:
+            for block in iter_digest_blocks(os.path.join(directory, name)):
+                buffer += block
+                if len(buffer) >= run_digests * DIGEST_SIZE:
+                    flush()
+        if buffer:
+            flush()
+
+        # Merge the runs and the existing store, dropping duplicates
+        inputs = [open(run_path, 'rb') for run_path in runs]
+        store = HashStore(store_path) if previous is not None else None
+        body_path = os.path.join(temp_dir, 'body')
+        fanout = [0] * FANOUT_SIZE
+        count = 0
+        try:
+            streams = [iter_records(run) for run in inputs]
+            if store is not None:
+                streams.append(store.iter_digests())
+            last = None
+            with open(body_path, 'wb', buffering=READ_SIZE) as body:
+                for digest in heapq.merge(*streams):
+                    if digest != last:
+                        body.write(digest)
+                        fanout[(digest[0] << 8 | digest[1]) + 1] += 1
+                        count += 1
+                        last = digest
+        finally:
+            for run in inputs:
+                run.close()
+            if store is not None:
+                store.close()
+
+        for prefix in range(1, FANOUT_SIZE):
+            fanout[prefix] += fanout[prefix - 1]
+
+        # Write the store to a temporary file and move it into place
+        temp_path = os.path.join(temp_dir, 'store')
+        with open(body_path, 'rb') as body, open(temp_path, 'wb') as output:
+            bloom, bits = build_bloom(body, count, bloom_bits, bloom_hashes) if bloom_bits else (b'', 0)
+            output.write(STORE_HEADER.pack(STORE_MAGIC, count, bits, bloom_hashes if bits else 0))
+            output.write(FANOUT.pack(*fanout))
+            output.write(bloom + b'\0' * (-len(bloom) % DIGEST_SIZE))
+            body.seek(0)
+            shutil.copyfileobj(body, output, READ_SIZE)
+        os.replace(temp_path, store_path)
+
+    temp_path = sources_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump({'bloom': [bloom_bits, bloom_hashes], 'sources': sources}, file, indent=1)
+    os.replace(temp_path, sources_path)
+    return len(new_files)
+
+
+def file_md5(file_path):
+    """Returns the hex MD5 of a file, read in blocks"""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def main():
+    """Main program entry point"""
+    parser = argparse.ArgumentParser(description="Builds and queries a compact store of malware MD5 hashes")
+    parser.add_argument("-d", "--directory", help="Directory of the scraped hash files", default='ioc_data/')
+    parser.add_argument("-s", "--store", help="Path of the hash store, hashes.bin in the directory by default")
+    parser.add_argument("-b", "--build", help="Builds the store, merging only new and grown hash files when possible", action='store_true')
+    parser.add_argument("--rebuild", help="Rebuilds the store from all hash files", action='store_true')
+    parser.add_argument("--bloom", help="Bloom filter bits per hash, 0 for no filter", type=int, default=0)
+    parser.add_argument("-q", "--query", nargs='+', help="MD5 hashes to look up")
+    parser.add_argument("-f", "--file", help="File of MD5 hashes to look up, one per line, - for stdin")
+    parser.add_argument("-c", "--check", nargs='+', help="Files whose MD5 is looked up")
+    args = parser.parse_args()
+
+    store_path = args.store or os.path.join(args.directory, 'hashes.bin')
+    if args.build or args.rebuild:
+        parsed = build_store(args.directory, store_path, args.bloom, incremental=not args.rebuild)
+        print("Merged {} hash files into {}".format(parsed, store_path) if parsed
+              else "{} is up to date".format(store_path))
+
+    if not (args.query or args.file or args.check):
+        if not (args.build or args.rebuild):
+            parser.print_usage()
+        return
+
+    with HashStore(store_path) as store:
+        for value, found in store.lookup(args.query or []):
+            print("{} {}".format(value, "FOUND" if found else "not found"))
+        if args.file:
+            file = sys.stdin if args.file == '-' else open(args.file)
+            try:
+                for value, found in store.lookup(line.strip() for line in file if line.strip()):
+                    print("{} {}".format(value, "FOUND" if found else "not found"))
+            finally:
+                if file is not sys.stdin:
+                    file.close()
+        for file_path in args.check or []:
+            md5 = file_md5(file_path)
+            print("{} {} {}".format(file_path, md5, "FOUND" if md5 in store else "not found"))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,88 @@ https://github.com/adityarkelkar/python-log-parser/blob/master/log
 """
 
 import argparse
+import bz2
+import calendar
+import glob
+import gzip
+import hashlib
+import io
+import ipaddress
+import json
+import locale
+import lzma
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+# NumPy is only needed by the analytics mode
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# zstandard is only needed to read .zst archives
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Number of characters read from a log file at a time
+BLOCK_SIZE = 1 << 20
+
+# Number of decompressed blocks buffered ahead of the parser
+PREFETCH_DEPTH = 16
+
+# Rotated log archives, e.g. access.log.3.gz
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+ROTATION_PATTERN = re.compile(r'\.(\d+)(?:\.(?:gz|bz2|xz|zst))?$')
+
+# Target number of bytes scanned by each worker task in parallel mode
+CHUNK_SIZE = 64 << 20
+
+# On-disk ip index layout: a header recording the indexed log's size and
+# mtime, followed by (ip key, line offset) records sorted by key then offset
+INDEX_SUFFIX = '.ipidx'
+INDEX_MAGIC = b'CLFIDX01'
+INDEX_HEADER = struct.Struct('<8sQQQ')
+INDEX_RECORD = struct.Struct('<QQ')
+
+# Files written next to the logs, skipped when expanding a directory or glob
+NON_LOG_SUFFIXES = (INDEX_SUFFIX, '.tmp', '.json')
+CHECKPOINT_PREFIX = b'{"file_path"'
+
+# Number of ip addresses whose indicator matches each IndicatorSet caches
+MATCH_CACHE_SIZE = 1 << 16
+
+# Single compiled pattern used to tokenize a CLF line in one pass
+CLF_PATTERN = re.compile(
+    r'(?P<ip_address>\S+) \S+ \S+ \[(?P<timestamp>[^\]]*)\] '
+    r'"(?P<http_request>[^"]*)" (?P<http_response_code>\S+) (?P<object_size>\S+)'
+    r'(?: "(?P<url>[^"]*)" "(?P<user_agent>[^"]*)")?')
+
+# Pattern extracting the analytics columns from every line of a block at once
+ANALYTICS_PATTERN = re.compile(
+    r'^(\S+) \S+ \S+ \[(\d\d/\w{3}/\d{4}):(\d\d):(\d\d):(\d\d) ([+-]\d{4})\] '
+    r'"[^"]*" (\d{3}) (\d+|-)', re.MULTILINE)
+
+MONTHS = {month: number for number, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+# Month names packed into integers for the vectorized analytics parser, the
+# longest client ip and object size it parses without the pattern and the
+# zero padding it reads past a block
+if np is not None:
+    MONTH_KEYS, MONTH_NUMBERS = (np.array(column, dtype=np.int64) for column in zip(*sorted(
+        (int.from_bytes(month.encode(), 'big'), number) for month, number in MONTHS.items())))
+MAX_IP_LENGTH = 64
+MAX_SIZE_DIGITS = 18
+COLUMN_PADDING = 64
 
 class LogEntry:
     """Object to parse CLF log lines into a common data structure 
@@ -54,58 +136,1107 @@ class LogEntry:
         if target_ip != self.ip_address:
             return False
         return True
-    
+
+def _lazy_field(name):
+    """Returns a property that materializes a CLF field on first access"""
+    def getter(self):
+        if self._fields is None:
+            self._parse()
+        return self._fields[name]
+    return property(getter)
+
+class FastLogEntry:
+    """Lightweight alternative to LogEntry. The log line is tokenized once
+    with CLF_PATTERN, and only when a field other than the ip address is
+    first accessed.
+
+    Attributes: 
+        ip_address(string): The ip address field within the log line
+        timestamp(string): The timestamp field within the log line
+        http_request(string): The HTTP request field within the log line
+        http_response_code(string): The HTTP response code within the log line
+        object_size(string): The object size within the log line
+        url(string): The origin URL within the log line
+        user_agent(string): The User Agent field within the log line
+
+    Methods:
+        match_ip(target_ip): Checks if a target ip matches the FastLogEntry ip_address attribute
+    """
+    __slots__ = ('entry', '_fields')
+
+    def __init__(self, entry):
+        # Store the raw line only, fields are parsed on demand
+        self.entry = entry
+        self._fields = None
+
+    def _parse(self):
+        """Tokenizes the log line with CLF_PATTERN and caches the fields"""
+        match = CLF_PATTERN.match(self.entry)
+        if match is None:
+            raise ValueError("Malformed CLF log line: {!r}".format(self.entry))
+        self._fields = match.groupdict()
+
+    @property
+    def ip_address(self):
+        # The ip address is the line prefix, no need to run the full pattern
+        return self.entry.split(" ", 1)[0].strip()
+
+    timestamp = _lazy_field('timestamp')
+    http_request = _lazy_field('http_request')
+    http_response_code = _lazy_field('http_response_code')
+    object_size = _lazy_field('object_size')
+    url = _lazy_field('url')
+    user_agent = _lazy_field('user_agent')
+
+    __str__ = LogEntry.__str__
+
+    def match_ip(self, target_ip):
+        """Method to check if a target ip matches the FastLogEntry ip_address attribute
+           Returns false if a match is not found, otherwise true
+
+           Parameters:
+               target_ip(str)
+           """
+        return self.entry.startswith(target_ip + " ")
+
+def expand_log_paths(file_path):
+    """Expands a log file, directory or glob pattern into a list of log files,
+       ordered oldest first following logrotate numbering: access.log.N.gz,
+       ..., access.log.1, access.log
+
+       Parameters:
+           file_path(str): A file, a directory or a glob pattern
+    """
+    if os.path.isdir(file_path):
+        paths = [os.path.join(file_path, name) for name in os.listdir(file_path)]
+    elif glob.has_magic(file_path):
+        paths = glob.glob(file_path)
+    else:
+        return [file_path]
+    paths = [path for path in paths if os.path.isfile(path) and is_log_file(path)]
+
+    def rotation_key(path):
+        match = ROTATION_PATTERN.search(path)
+        return (-int(match.group(1)) if match else 0, path)
+    return sorted(paths, key=rotation_key)
+
+def is_log_file(file_path):
+    """Returns false for the ip indexes, follow checkpoints and temporary
+       files this script writes next to the logs it reads"""
+    if file_path.endswith(NON_LOG_SUFFIXES):
+        return False
+    with open(file_path, 'rb') as file:
+        head = file.read(len(CHECKPOINT_PREFIX))
+    return not (head.startswith(INDEX_MAGIC) or head == CHECKPOINT_PREFIX)
+
+def open_log(file_path):
+    """Opens a plain or compressed log file as a text stream
+
+       Parameters:
+           file_path(str): A plain, .gz, .bz2, .xz or .zst log file
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt')
+    if file_path.endswith('.bz2'):
+        return bz2.open(file_path, 'rt')
+    if file_path.endswith('.xz'):
+        return lzma.open(file_path, 'rt')
+    if file_path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Reading .zst logs requires zstandard")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True))
+    return open(file_path)
+
+def read_file_blocks(file_path, block_size=BLOCK_SIZE):
+    """Generator yielding blocks of about block_size characters from a
+       plain or compressed log file. Each block holds complete lines only
+
+       Parameters:
+           file_path(str)
+           block_size(int)
+    """
+    with open_log(file_path) as file:
+        remainder = ''
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+
+            # Keep the trailing partial line for the next block
+            block = remainder + block
+            cut = block.rfind('\n') + 1
+            remainder = block[cut:]
+            if cut:
+                yield block[:cut]
+
+        if remainder:
+            yield remainder
+
+def prefetch_blocks(file_paths, block_size=BLOCK_SIZE, depth=PREFETCH_DEPTH):
+    """Generator yielding the blocks of a sequence of log files in order.
+       A background thread reads and decompresses ahead of the consumer,
+       so parsing does not wait on decompression. Memory is bounded by depth
+
+       Parameters:
+           file_paths(list)
+           block_size(int)
+           depth(int): Maximum number of blocks buffered ahead
+    """
+    blocks = queue.Queue(depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        # Give up if the consumer went away while the queue is full
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for file_path in file_paths:
+                for block in read_file_blocks(file_path, block_size):
+                    if not put(block):
+                        return
+            put(end)
+        except Exception as e:
+            put(e)
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = blocks.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join()
+
+def split_ranges(file_path, workers, chunk_size=CHUNK_SIZE):
+    """Splits a file into byte ranges that start and end on line boundaries
+
+       Parameters:
+           file_path(str): The file to be split
+           workers(int): Minimum number of ranges to produce for non-trivial files
+           chunk_size(int): Maximum size of a range in bytes
+
+       Returns:
+           ranges(list): A list of (start, end) byte offset tuples in file order
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+
+    step = max(1, min(chunk_size, -(-size // workers)))
+    ranges = []
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                # Move the range end forward to just after the next newline
+                end = mm.find(b'\n', min(start + step, size) - 1)
+                end = size if end == -1 else end + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+def scan_range(file_path, start, end, target_ip):
+    """Returns the lines within a byte range of a CLF log whose ip prefix
+       matches a target ip. Runs inside LogParser worker processes
+
+       Parameters:
+           file_path(str): The CLF log file to be scanned
+           start(int): Byte offset of the first line in the range
+           end(int): Byte offset just after the last line in the range
+           target_ip(str)
+    """
+    prefix = (target_ip + " ").encode()
+    encoding = locale.getpreferredencoding(False)
+    lines = []
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+            # The first line of the range has no preceding newline
+            if mm[start:start + len(prefix)] == prefix:
+                position = start
+            else:
+                position = mm.find(b'\n' + prefix, start, end)
+                position = -1 if position == -1 else position + 1
+
+            while position != -1:
+                line_end = mm.find(b'\n', position, end)
+                line_end = end if line_end == -1 else line_end + 1
+                lines.append(mm[position:line_end].decode(encoding).replace('\r\n', '\n'))
+
+                position = mm.find(b'\n' + prefix, line_end - 1, end)
+                position = -1 if position == -1 else position + 1
+    return lines
+
+def ip_key(ip_address):
+    """Returns the 64-bit index key of an ip address given as bytes"""
+    return int.from_bytes(hashlib.blake2b(ip_address, digest_size=8).digest(), 'little')
+
+class IpIndex:
+    """Memory-mapped index of the byte offsets of the lines of a CLF log,
+    grouped by client ip
+
+    Attributes:
+        index_path(string): The index file
+        log_size(int): Size of the log file when it was indexed
+        log_mtime(int): Modification time of the log file in ns when it was indexed
+        count(int): Number of indexed lines
+
+    Methods:
+        build(file_path, index_path): Indexes a CLF log and writes the index file
+        is_fresh(file_path): Checks whether the index still describes a log file
+        offsets(target_ip): Returns the byte offsets of the lines matching target ip
+        close(): Releases the memory-mapped index file
+    """
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.log_size, self.log_mtime, self.count = INDEX_HEADER.unpack_from(self.mm)
+        if magic != INDEX_MAGIC:
+            self.mm.close()
+            raise ValueError("Not a log index file: {}".format(index_path))
+
+    @staticmethod
+    def build(file_path, index_path=None):
+        """Indexes a CLF log in a single streaming pass and writes the sorted index
+
+           Parameters:
+               file_path(str): The CLF log to be indexed
+               index_path(str): The index file, defaults to file_path + INDEX_SUFFIX
+           """
+        index_path = index_path or file_path + INDEX_SUFFIX
+        stat = os.stat(file_path)
+
+        # Collect line offsets per ip key, offsets are naturally in file order
+        offsets = {}
+        position = 0
+        with open(file_path, 'rb') as file:
+            for line in file:
+                key = ip_key(line.split(b' ', 1)[0])
+                if key not in offsets:
+                    offsets[key] = array('Q')
+                offsets[key].append(position)
+                position += len(line)
+
+        # Write to a temporary file first so readers never see a partial index
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'wb') as index:
+            count = sum(len(key_offsets) for key_offsets in offsets.values())
+            index.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, count))
+            for key in sorted(offsets):
+                index.write(b''.join(INDEX_RECORD.pack(key, offset) for offset in offsets[key]))
+        os.replace(temp_path, index_path)
+
+    def is_fresh(self, file_path):
+        """Returns true if the log file has not changed since it was indexed"""
+        stat = os.stat(file_path)
+        return stat.st_size == self.log_size and stat.st_mtime_ns == self.log_mtime
+
+    def offsets(self, target_ip):
+        """Returns the byte offsets of the lines whose ip key matches target ip,
+           found by binary search over the sorted records
+
+           Parameters:
+               target_ip(str)
+           """
+        key = ip_key(target_ip.encode())
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        offsets = []
+        while low < self.count:
+            record_key, offset = self._record(low)
+            if record_key != key:
+                break
+            offsets.append(offset)
+            low += 1
+        return offsets
+
+    def _record(self, position):
+        """Returns the (key, offset) record at a position in the index"""
+        return INDEX_RECORD.unpack_from(self.mm, INDEX_HEADER.size + position * INDEX_RECORD.size)
+
+    def close(self):
+        self.mm.close()
+
+class IndicatorSet:
+    """Precompiled set of ip addresses and CIDR ranges, used to tag log
+    lines with every indicator they match in a single pass
+
+    Exact addresses are kept in a hash set. CIDR ranges are grouped by
+    prefix length into hash maps of network address to range, so each
+    lookup costs one masked probe per distinct prefix length.
+
+    Attributes:
+        addresses(dict): Maps ip address integers to indicator strings
+        networks(dict): Maps (version, prefix length) to a dict of network integers to indicator strings
+
+    Methods:
+        from_file(file_path): Loads indicators from a file, one per line
+        add(indicator): Adds an ip address or CIDR range
+        match(ip_address): Returns the indicators an ip address matches
+    """
+    def __init__(self, indicators=()):
+        self.addresses = {}
+        self.networks = {}
+        self._matches = {}
+        for indicator in indicators:
+            self.add(indicator)
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Loads indicators from a file. Blank lines and # comments are ignored
+
+           Raises:
+               ValueError: naming the file and line of an invalid indicator
+           """
+        indicators = cls()
+        with open(file_path) as file:
+            for line_number, line in enumerate(file, 1):
+                indicator = line.split('#', 1)[0].strip()
+                if not indicator:
+                    continue
+                try:
+                    indicators.add(indicator)
+                except ValueError:
+                    raise ValueError("{}:{}: invalid indicator '{}'".format(file_path, line_number, indicator)) from None
+        return indicators
+
+    def add(self, indicator):
+        """Adds an ip address or CIDR range indicator
+
+           Parameters:
+               indicator(str): e.g. 10.0.0.1 or 10.0.0.0/8
+           """
+        network = ipaddress.ip_network(indicator, strict=False)
+        if network.num_addresses == 1:
+            self.addresses[(network.version, int(network.network_address))] = indicator
+        else:
+            key = (network.version, network.prefixlen)
+            self.networks.setdefault(key, {})[int(network.network_address)] = indicator
+        self._matches.clear()
+
+    def match(self, ip_address):
+        """Returns a tuple of the indicators an ip address matches,
+           empty if none match or ip_address is not an ip address.
+           Results are cached per instance, up to MATCH_CACHE_SIZE addresses
+
+           Parameters:
+               ip_address(str)
+           """
+        matches = self._matches.get(ip_address)
+        if matches is None:
+            if len(self._matches) >= MATCH_CACHE_SIZE:
+                self._matches.clear()
+            matches = self._matches[ip_address] = self._match(ip_address)
+        return matches
+
+    def _match(self, ip_address):
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return ()
+
+        value = int(address)
+        matches = []
+        exact = self.addresses.get((address.version, value))
+        if exact is not None:
+            matches.append(exact)
+
+        # Probe each prefix length with the address masked to that length
+        for (version, prefix_length), networks in self.networks.items():
+            if version != address.version:
+                continue
+            host_bits = address.max_prefixlen - prefix_length
+            network = networks.get(value >> host_bits << host_bits)
+            if network is not None:
+                matches.append(network)
+        return tuple(matches)
+
+class LogAnalytics:
+    """Columnar analytics over a CLF log. Blocks of lines are converted into
+    typed NumPy column batches (integer-encoded client ips, epoch timestamps,
+    status codes and object sizes) and aggregated with vectorized operations
+
+    Attributes:
+        log_parser(LogParser): Parser providing the log blocks
+        ip_names(list): Client ips, indexed by their integer code
+        client_counts(ndarray): Number of requests per client ip code
+        status_counts(ndarray): Number of responses per HTTP status code
+        minute_bytes(dict): Maps epoch minutes to bytes served in that minute
+        line_count(int): Number of lines aggregated
+
+    Methods:
+        run(): Streams the log through the aggregations
+        iter_batches(): Lazily yields column batches for each block of the log
+        aggregate(batch): Folds a column batch into the running aggregates
+        top_clients(n): Returns the n clients with the most requests
+        status_histogram(): Returns a dict of status codes to response counts
+        bytes_per_minute(): Returns a sorted list of (epoch minute, bytes) tuples
+        print_summary(n): Prints the aggregates to the console
+    """
+    def __init__(self, log_parser):
+        if np is None:
+            raise ImportError("Analytics mode requires numpy")
+
+        self.log_parser = log_parser
+        self.ip_codes = {}
+        self.ip_names = []
+        self.day_epochs = {}
+        self.client_counts = np.zeros(0, dtype=np.int64)
+        self.status_counts = np.zeros(1000, dtype=np.int64)
+        self.minute_bytes = {}
+        self.line_count = 0
+
+    def run(self):
+        """Streams every block of the log through the aggregations"""
+        for batch in self.iter_batches():
+            self.aggregate(batch)
+        return self
+
+    def iter_batches(self):
+        """Generator yielding a dict of column arrays per block of the log"""
+        for block in self.log_parser.read_blocks():
+            batch = self.to_columns(block)
+            if len(batch['ip']):
+                yield batch
+
+    def to_columns(self, block):
+        """Converts the lines of a block into typed column arrays
+
+        Fields are located with vectorized searches over the raw bytes of
+        the block and their digits are converted arithmetically, so no
+        per-line Python objects are built. Lines whose layout the checks
+        cannot vouch for are matched with ANALYTICS_PATTERN one by one,
+        so the rows are those the pattern accepts.
+        """
+        data = block.encode('utf-8')
+        size = len(data)
+        buf = np.frombuffer(data + bytes(COLUMN_PADDING), dtype=np.uint8)
+        text = buf[:size]
+
+        ends = np.flatnonzero(text == 10)
+        if size and (not len(ends) or ends[-1] != size - 1):
+            ends = np.append(ends, size)
+        starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+
+        def first_after(mask, offsets):
+            """Returns the first position of mask at or after each offset, or size"""
+            positions = np.append(np.flatnonzero(mask), size)
+            return positions[np.searchsorted(positions, offsets)]
+
+        def digits(offsets, width):
+            """Returns the values of width-digit fields and whether they are all digits"""
+            value = np.zeros(len(offsets), dtype=np.int64)
+            valid = np.ones(len(offsets), dtype=bool)
+            for position in range(width):
+                digit = buf[offsets + position] - np.uint8(48)
+                valid &= digit < 10
+                value = value * 10 + digit
+            return value, valid
+
+        # Three space-separated tokens, the first being the client ip, then '['
+        space = text == 32
+        bracket = first_after(text == 91, starts)
+        ip_end = first_after(space, starts)
+        second_end = first_after(space, ip_end + 1)
+        third_end = first_after(space, second_end + 1)
+        ok = ((bracket < ends) & (third_end + 1 == bracket)
+              & (ip_end > starts) & (second_end > ip_end + 1) & (third_end > second_end + 1)
+              & (first_after(text - np.uint8(32) >= 95, starts) > bracket)  # control or non-ASCII bytes
+              & (ip_end - starts <= MAX_IP_LENGTH))
+
+        # [dd/Mon/yyyy:hh:mm:ss +zzzz] "request" status size
+        t = bracket + 1
+        day, valid_day = digits(t, 2)
+        year, valid_year = digits(t + 7, 4)
+        hour, valid_hour = digits(t + 12, 2)
+        minute, valid_minute = digits(t + 15, 2)
+        second, valid_second = digits(t + 18, 2)
+        zone, valid_zone = digits(t + 22, 4)
+        month_key = (buf[t + 3].astype(np.int64) << 16) | (buf[t + 4].astype(np.int64) << 8) | buf[t + 5]
+        month_index = np.minimum(np.searchsorted(MONTH_KEYS, month_key), len(MONTH_KEYS) - 1)
+        sign = buf[t + 21]
+        ok &= (valid_day & valid_year & (year > 0) & valid_hour & valid_minute & valid_second & valid_zone
+               & (MONTH_KEYS[month_index] == month_key) & ((sign == 43) | (sign == 45))
+               & (buf[t + 2] == 47) & (buf[t + 6] == 47) & (buf[t + 11] == 58) & (buf[t + 14] == 58)
+               & (buf[t + 17] == 58) & (buf[t + 20] == 32) & (buf[t + 26] == 93) & (buf[t + 27] == 32)
+               & (buf[t + 28] == 34))
+
+        quote = first_after(text == 34, t + 29)
+        status, valid_status = digits(quote + 2, 3)
+        size_start = quote + 6
+        dash = buf[size_start] == 45
+        ok &= (quote < ends) & (buf[quote + 1] == 32) & valid_status & (buf[quote + 5] == 32)
+
+        # Object sizes have up to 18 digits, '-' counts as 0
+        object_size = np.zeros(len(starts), dtype=np.int64)
+        size_length = np.zeros(len(starts), dtype=np.int64)
+        running = ok & ~dash
+        for position in range(MAX_SIZE_DIGITS + 1):
+            digit = buf[size_start + position] - np.uint8(48)
+            running &= digit < 10
+            if not running.any():
+                break
+            object_size = np.where(running, object_size * 10 + digit, object_size)
+            size_length += running
+        ok &= dash | ((size_length >= 1) & (size_length <= MAX_SIZE_DIGITS))
+
+        # Epoch seconds, with days counted from the civil date
+        month = MONTH_NUMBERS[month_index]
+        shifted_year = year - (month <= 2)
+        era = shifted_year // 400
+        year_of_era = shifted_year - era * 400
+        day_of_year = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+        days = era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year - 719468
+        offset = ((zone // 100) * 3600 + (zone % 100) * 60) * np.where(sign == 45, -1, 1)
+        timestamp = days * 86400 + hour * 3600 + minute * 60 + second - offset
+
+        # Fixed-width byte strings of the client ips
+        ip_length = np.where(ok, ip_end - starts, 0)
+        width = max(int(ip_length.max()) if len(ip_length) else 0, 1)
+        columns = np.arange(width)
+        ip_bytes = np.where(columns < ip_length[:, None], buf[starts[:, None] + columns], 0).astype(np.uint8)
+        ips = ip_bytes.view('S{}'.format(width)).ravel()
+
+        rows = np.flatnonzero(ok)
+        ips, timestamp, status, object_size = ips[rows], timestamp[rows], status[rows], object_size[rows]
+
+        # Lines the checks rejected go through the pattern, those with a date
+        # that is not a calendar day or a size beyond 64 bits are skipped
+        fallback = []
+        for line in np.flatnonzero(~ok).tolist():
+            match = ANALYTICS_PATTERN.match(data[starts[line]:ends[line]].decode('utf-8'))
+            if not match:
+                continue
+            ip, day_text, hour_text, minute_text, second_text, zone_text, status_text, size_text = match.groups()
+            try:
+                line_timestamp = (self._day_epoch(day_text, zone_text)
+                                  + int(hour_text) * 3600 + int(minute_text) * 60 + int(second_text))
+            except (KeyError, ValueError):
+                continue
+            line_size = 0 if size_text == '-' else int(size_text)
+            if line_size >> 63:
+                continue
+            fallback.append((line, ip.encode('utf-8'), line_timestamp, int(status_text), line_size))
+        if fallback:
+            lines, fallback_ips, fallback_timestamps, fallback_statuses, fallback_sizes = zip(*fallback)
+            order = np.argsort(np.concatenate((rows, lines)), kind='stable')
+            ips = np.concatenate((ips, np.array(fallback_ips)))[order]
+            timestamp = np.concatenate((timestamp, fallback_timestamps))[order]
+            status = np.concatenate((status, fallback_statuses))[order]
+            object_size = np.concatenate((object_size, fallback_sizes))[order]
+
+        # Dictionary-encode client ips, new ones in order of first appearance
+        names, first, inverse = np.unique(ips, return_index=True, return_inverse=True)
+        lookup = np.empty(len(names), dtype=np.int64)
+        codes = self.ip_codes
+        for position in np.argsort(first, kind='stable').tolist():
+            ip = names[position].decode('utf-8')
+            lookup[position] = codes[ip] if ip in codes else self._encode_ip(ip)
+
+        return {'ip': lookup[inverse.ravel()],
+                'timestamp': timestamp.astype(np.int64),
+                'status': status.astype(np.int64),
+                'object_size': object_size.astype(np.int64)}
+
+    def _encode_ip(self, ip):
+        """Assigns the next integer code to a new client ip"""
+        code = self.ip_codes[ip] = len(self.ip_names)
+        self.ip_names.append(ip)
+        return code
+
+    def _day_epoch(self, day, zone):
+        """Returns the epoch of midnight for a CLF date and timezone offset"""
+        key = (day, zone)
+        if key not in self.day_epochs:
+            offset = (int(zone[1:3]) * 3600 + int(zone[3:5]) * 60) * (-1 if zone[0] == '-' else 1)
+            date = (int(day[7:11]), MONTHS[day[3:6]], int(day[0:2]), 0, 0, 0)
+            self.day_epochs[key] = calendar.timegm(date) - offset
+        return self.day_epochs[key]
+
+    def aggregate(self, batch):
+        """Folds a column batch into the running aggregates"""
+        self.line_count += len(batch['ip'])
+
+        # Requests per client ip code
+        counts = np.bincount(batch['ip'], minlength=len(self.ip_names))
+        counts[:len(self.client_counts)] += self.client_counts
+        self.client_counts = counts
+
+        # Responses per status code
+        self.status_counts += np.bincount(batch['status'], minlength=len(self.status_counts))
+
+        # Bytes served per epoch minute
+        minutes, inverse = np.unique(batch['timestamp'] // 60, return_inverse=True)
+        served = np.zeros(len(minutes), dtype=np.int64)
+        np.add.at(served, inverse.ravel(), batch['object_size'])
+        for minute, total in zip(minutes.tolist(), served.tolist()):
+            self.minute_bytes[minute] = self.minute_bytes.get(minute, 0) + total
+
+    def top_clients(self, n=10):
+        """Returns a list of (ip, requests) tuples for the n busiest clients"""
+        n = min(n, len(self.client_counts))
+        if n == 0:
+            return []
+
+        top = np.argpartition(self.client_counts, -n)[-n:]
+        top = top[np.lexsort((top, -self.client_counts[top]))]
+        return [(self.ip_names[code], int(self.client_counts[code])) for code in top]
+
+    def status_histogram(self):
+        """Returns a dict of status codes to response counts"""
+        codes = np.flatnonzero(self.status_counts)
+        return {int(code): int(self.status_counts[code]) for code in codes}
+
+    def bytes_per_minute(self):
+        """Returns a sorted list of (epoch minute, bytes served) tuples"""
+        return sorted(self.minute_bytes.items())
+
+    def print_summary(self, n=10):
+        """Prints the aggregates to the console"""
+        print("Analyzed {} log lines".format(self.line_count))
+
+        print("Top {} clients:".format(n))
+        for ip, requests in self.top_clients(n):
+            print("    {:39} {}".format(ip, requests))
+
+        print("Status codes:")
+        for code, responses in self.status_histogram().items():
+            print("    {} {}".format(code, responses))
+
+        print("Bytes served per minute:")
+        for minute, served in self.bytes_per_minute():
+            print("    {} {}".format(minute * 60, served))
+
+class LogFollower:
+    """Follows a growing CLF log like tail -F, yielding only newly appended
+    lines. The offset of the last processed line is persisted to a checkpoint
+    file, so a restarted follower resumes where it stopped. Truncation and
+    rotation (a new inode at the log path) are detected on every poll
+
+    Attributes:
+        file_path(string): The CLF log to follow
+        checkpoint_path(string): JSON file recording the followed inode and offset, optional
+        poll_interval(float): Seconds to wait for new data when the log is idle
+        block_size(int): Number of bytes read from the log at a time
+
+    Methods:
+        iter_lines(): Lazily yields appended lines, forever
+        save_checkpoint(): Persists the current inode and offset
+    """
+    def __init__(self, file_path, checkpoint_path=None, poll_interval=1.0, block_size=BLOCK_SIZE):
+        self.file_path = file_path
+        self.checkpoint_path = checkpoint_path
+        self.poll_interval = poll_interval
+        self.block_size = block_size
+        self.encoding = locale.getpreferredencoding(False)
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.partial = bytearray()
+
+    def iter_lines(self):
+        """Generator yielding complete lines as they are appended to the log.
+           The checkpoint is saved once the lines of each read were consumed"""
+        try:
+            while True:
+                if self.file is None and not self._open():
+                    time.sleep(self.poll_interval)
+                    continue
+
+                lines = self._read()
+                if lines:
+                    for line in lines:
+                        yield line
+                    self.save_checkpoint()
+                    continue
+
+                # No new data, check for truncation or rotation before waiting
+                if not self._check_file():
+                    time.sleep(self.poll_interval)
+        finally:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _open(self):
+        """Opens the log, resuming from the checkpoint when it matches the
+           current inode and size. Returns false if the log does not exist"""
+        try:
+            self.file = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        stat = os.fstat(self.file.fileno())
+        self.inode = (stat.st_dev, stat.st_ino)
+        self.offset = 0
+        self.partial.clear()
+
+        checkpoint = self._load_checkpoint()
+        if checkpoint and tuple(checkpoint['inode']) == self.inode and checkpoint['offset'] <= stat.st_size:
+            self.offset = checkpoint['offset']
+        self.file.seek(self.offset)
+        return True
+
+    def _read(self):
+        """Returns the complete lines appended since the last read. A trailing
+           partial line is kept and completed by later reads, so lines longer
+           than block_size are read in several blocks"""
+        while True:
+            data = self.file.read(self.block_size)
+            if not data:
+                return []
+            self.partial += data
+            cut = self.partial.rfind(b'\n', len(self.partial) - len(data)) + 1
+            if cut:
+                break
+            if len(data) < self.block_size:
+                return []
+
+        lines = self.partial[:cut]
+        del self.partial[:cut]
+        self.offset += cut
+        return [line.decode(self.encoding).replace('\r\n', '\n') + '\n'
+                for line in lines.split(b'\n')[:-1]]
+
+    def _check_file(self):
+        """Handles truncation and rotation of the log. Returns true if the
+           log should be read again immediately"""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return False
+
+        if (stat.st_dev, stat.st_ino) != self.inode:
+            # Rotated: drain complete lines still unread in the old file first
+            if self._has_complete_line():
+                return True
+            self.file.close()
+            self.file = None
+            return True
+
+        if stat.st_size < self.offset:
+            # Truncated in place: start again from the beginning
+            self.offset = 0
+            self.partial.clear()
+            self.file.seek(0)
+            self.save_checkpoint()
+            return True
+        return False
+
+    def _has_complete_line(self):
+        """Returns true if the partial line read so far is completed in the file"""
+        position = self.file.tell()
+        try:
+            while True:
+                data = self.file.read(self.block_size)
+                if not data:
+                    return False
+                if b'\n' in data:
+                    return True
+        finally:
+            self.file.seek(position)
+
+    def _load_checkpoint(self):
+        """Returns the saved checkpoint dict, or None if there is none"""
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as file:
+            return json.load(file)
+
+    def save_checkpoint(self):
+        """Atomically persists the followed inode and offset"""
+        if not self.checkpoint_path:
+            return
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'file_path': self.file_path, 'inode': self.inode, 'offset': self.offset}, file)
+        os.replace(temp_path, self.checkpoint_path)
+
 class LogParser:
     """Object to parse CLF logs and run searches for specific entries
 
     Attributes: 
-        file_path(string): A CLF log file to be parsed by object's methods
+        file_path(string): A CLF log file to be parsed by object's methods. May also be
+                           a directory or glob of plain, .gz, .bz2, .xz and .zst logs
+        fast(bool): Use FastLogEntry and reject lines on the ip prefix alone
+        block_size(int): Number of characters read from the log file at a time
+        workers(int): Number of processes scanning the memory-mapped log, 1 scans serially. Single plain files only
+        use_index(bool): Seek using a fresh IpIndex next to the log file when one exists. Single plain files only
 
     Methods:
-        search_ip(target_ip): searches for entries in a CLF log that match target ip
+        search_ip(target_ip, output): searches for entries in a CLF log that match target ip
+        iter_ip(target_ip): lazily yields entries in a CLF log that match target ip
+        search_indicators(indicators, output): searches a CLF log for entries matching any of an IndicatorSet
+        iter_indicators(indicators): lazily yields entries and the indicators they match
+        read_lines(): lazily yields the lines of the CLF log using block reads
+        build_index(): writes an IpIndex for the CLF log
+        follow(target_ip, indicators, output, checkpoint_path, poll_interval): watches the CLF log for new matching entries
     """
-    def __init__(self, file_path):
+    def __init__(self, file_path, fast=False, block_size=BLOCK_SIZE, workers=1, use_index=True):
         self.file_path = file_path
+        self.fast = fast
+        self.block_size = block_size
+        self.workers = workers
+        self.use_index = use_index
 
-    def search_ip(self, target_ip):
+    def build_index(self):
+        """Method to index the CLF log so later ip searches can seek to matching lines"""
+        IpIndex.build(self.file_path)
+
+    def search_ip(self, target_ip, output=None):
         """Method to search for entries in a CLF log that match a target ip.
-           Prints all matches to the console
+           Writes each match to the output stream as soon as it is found
            
            Parameters:
                target_ip(str)
+               output(file): Stream to write matches to, defaults to the console
            """
         
         # Attempt to open and process file
         try:
 
-            # Iterate over log file lines
-            with open(self.file_path) as file:
-                for line in file.readlines():
-                    
-                    # Parse log line
-                    parsed_line = LogEntry(line)
+            # Write matches as they are yielded by the parser
+            for parsed_line in self.iter_ip(target_ip):
+                print(parsed_line, file=output)
+
+        # Catch and report any file opening errors
+        except Exception as e:
+            print("Error:Could not open file:{}".format(e))
+
+    def search_indicators(self, indicators, output=None):
+        """Method to search for entries in a CLF log that match any ip address
+           or CIDR range in an IndicatorSet, in a single pass over the log.
+           Writes each match and the indicators it matched to the output stream
+           
+           Parameters:
+               indicators(IndicatorSet)
+               output(file): Stream to write matches to, defaults to the console
+           """
+
+        # Attempt to open and process file
+        try:
 
-                    # Check if target ip matches. If yes print line
-                    if parsed_line.match_ip(target_ip):
-                        print(parsed_line)
+            # Write matches as they are yielded by the parser
+            for parsed_line, matches in self.iter_indicators(indicators):
+                print("Matched indicators: {}".format(", ".join(matches)), file=output)
+                print(parsed_line, file=output)
 
         # Catch and report any file opening errors
         except Exception as e:
             print("Error:Could not open file:{}".format(e))
 
+    def follow(self, target_ip=None, indicators=None, output=None, checkpoint_path=None, poll_interval=1.0):
+        """Method to watch a live CLF log for new entries matching a target ip
+           or an IndicatorSet. Only appended lines are processed, and matches
+           are written as soon as they are found. Runs until interrupted
+           
+           Parameters:
+               target_ip(str)
+               indicators(IndicatorSet)
+               output(file): Stream to write matches to, defaults to the console
+               checkpoint_path(str): File used to resume after a restart
+               poll_interval(float): Seconds to wait for new data
+           """
+        entry_class = FastLogEntry if self.fast else LogEntry
+        prefix = target_ip + " " if target_ip else None
+        follower = LogFollower(self.file_path, checkpoint_path, poll_interval)
+        for line in follower.iter_lines():
+            matches = indicators.match(line.split(" ", 1)[0].strip()) if indicators else None
+            if matches:
+                print("Matched indicators: {}".format(", ".join(matches)), file=output)
+            if matches or (prefix and line.startswith(prefix)):
+                print(entry_class(line), file=output, flush=True)
+
+    def iter_indicators(self, indicators):
+        """Generator yielding (entry, matched indicators) tuples for the entries
+           in a CLF log whose ip address matches an IndicatorSet
+
+           Parameters:
+               indicators(IndicatorSet)
+           """
+        entry_class = FastLogEntry if self.fast else LogEntry
+        for line in self.read_lines():
+            matches = indicators.match(line.split(" ", 1)[0].strip())
+            if matches:
+                yield entry_class(line), matches
+
+    def iter_ip(self, target_ip):
+        """Generator yielding entries in a CLF log that match a target ip.
+           Memory use is bounded by the block size, not the log size
+           
+           Parameters:
+               target_ip(str)
+           """
+        index = self._open_index()
+        if index is not None:
+            try:
+                yield from self._indexed_iter_ip(index, target_ip)
+            finally:
+                index.close()
+            return
+
+        if self.workers > 1 and self.is_plain_file():
+            yield from self._parallel_iter_ip(target_ip)
+            return
+
+        # Reject non-matching lines on the ip prefix before parsing them, as
+        # the parallel scan does, so malformed lines of other clients are skipped
+        entry_class = FastLogEntry if self.fast else LogEntry
+        prefix = target_ip + " "
+        for line in self.read_lines():
+            if line.startswith(prefix):
+                yield entry_class(line)
+
+    def _open_index(self):
+        """Returns the IpIndex of the log if it exists and is fresh, otherwise None"""
+        index_path = self.file_path + INDEX_SUFFIX
+        if not self.use_index or not self.is_plain_file() or not os.path.exists(index_path):
+            return None
+
+        index = IpIndex(index_path)
+        if not index.is_fresh(self.file_path):
+            index.close()
+            return None
+        return index
+
+    def _indexed_iter_ip(self, index, target_ip):
+        """Seeks straight to the indexed lines of target ip, yielding them in file order"""
+        entry_class = FastLogEntry if self.fast else LogEntry
+        prefix = (target_ip + " ").encode()
+        encoding = locale.getpreferredencoding(False)
+        with open(self.file_path, 'rb') as file:
+            for offset in index.offsets(target_ip):
+                file.seek(offset)
+                line = file.readline()
+
+                # Guard against ip key collisions
+                if line.startswith(prefix):
+                    yield entry_class(line.decode(encoding).replace('\r\n', '\n'))
+
+    def _parallel_iter_ip(self, target_ip):
+        """Scans newline aligned byte ranges of the log in a process pool,
+           yielding matches in file order"""
+        entry_class = FastLogEntry if self.fast else LogEntry
+        ranges = split_ranges(self.file_path, self.workers)
+        if not ranges:
+            return
+
+        with ProcessPoolExecutor(self.workers) as executor:
+            starts, ends = zip(*ranges)
+            count = len(ranges)
+
+            # map() returns the per-range results in submission order
+            results = executor.map(scan_range, [self.file_path] * count, starts, ends, [target_ip] * count)
+            for lines in results:
+                for line in lines:
+                    yield entry_class(line)
+
+    def read_lines(self):
+        """Generator yielding the lines of the CLF log, reading the file
+           in blocks of block_size characters"""
+        for block in self.read_blocks():
+            lines = block.split('\n')
+
+            # Only the final block of the file can end without a newline
+            tail = lines.pop()
+            for line in lines:
+                yield line + '\n'
+            if tail:
+                yield tail
+
+    def read_blocks(self):
+        """Generator yielding blocks of about block_size characters from
+           the CLF log. Each block holds complete lines only. Log sets and
+           compressed files are decompressed ahead by a background thread"""
+        file_paths = self.log_paths()
+        if self.is_plain_file():
+            yield from read_file_blocks(file_paths[0], self.block_size)
+        else:
+            yield from prefetch_blocks(file_paths, self.block_size)
+
+    def log_paths(self):
+        """Returns the log files file_path refers to, oldest first"""
+        return expand_log_paths(self.file_path)
+
+    def is_plain_file(self):
+        """Returns true if file_path is a single uncompressed log file"""
+        file_paths = self.log_paths()
+        return len(file_paths) == 1 and file_paths[0] == self.file_path \
+            and not self.file_path.endswith(COMPRESSED_SUFFIXES)
+
 def main():
     """Main program entry point"""
     
     # setup command line parameters
     parser = argparse.ArgumentParser(description="Simple python parser for CLF logs")
-    parser.add_argument("-f", "--file", help="Target log file to be searched", required=True)
-    parser.add_argument("-ip", "--ip_address", help="Search log file for entries matching ip address", required=True)
+    parser.add_argument("-f", "--file", help="Target log file, directory or glob of plain and compressed log files to be searched", required=True)
+    parser.add_argument("-ip", "--ip_address", help="Search log file for entries matching ip address", required=False)
+    parser.add_argument("-i", "--indicators", help="Search log file for entries matching any ip address or CIDR range listed in this file", required=False)
+    parser.add_argument("-a", "--analytics", help="Print top clients, status codes and bytes served per minute", action='store_true')
+    parser.add_argument("-t", "--top", help="Number of clients listed by --analytics", type=int, default=10)
+    parser.add_argument("-F", "--follow", help="Keep watching the log file for new matching entries", action='store_true')
+    parser.add_argument("-c", "--checkpoint", help="Checkpoint file used by --follow to resume after a restart", required=False)
+    parser.add_argument("--build-index", help="Index the log file by ip address to speed up later searches", action='store_true')
+    parser.add_argument("--no-index", help="Ignore any existing index and scan the whole log file", action='store_true')
+    parser.add_argument("--fast", help="Use the single-pass lazy parser", action='store_true')
+    parser.add_argument("-w", "--workers", help="Number of processes used to scan the log file", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Write matches to this file as they are found instead of the console", required=False)
 
     # parse arguments
     args = parser.parse_args()
+    if not (args.ip_address or args.indicators or args.analytics or args.build_index):
+        parser.error("one of the arguments -ip/--ip_address -i/--indicators -a/--analytics --build-index is required")
+
+    # Load indicators up front so an invalid file is reported before any work
+    indicators = None
+    if args.indicators:
+        try:
+            indicators = IndicatorSet.from_file(args.indicators)
+        except (OSError, ValueError) as e:
+            print("Error:Could not load indicators:{}".format(e))
+            return
 
-    # Initiate LogParser object and run search
-    LogParser(args.file).search_ip(args.ip_address)
+    # Initiate LogParser object, build index if requested and run search
+    log_parser = LogParser(args.file, fast=args.fast, workers=args.workers, use_index=not args.no_index)
+    if args.build_index and not log_parser.is_plain_file():
+        parser.error("--build-index requires a single uncompressed log file")
+    if args.build_index:
+        log_parser.build_index()
+    output = open(args.output, 'w') if args.output else None
+    try:
+        if args.follow:
+            log_parser.follow(args.ip_address, indicators, output, args.checkpoint)
+            return
+        if args.ip_address:
+            log_parser.search_ip(args.ip_address, output)
+        if args.indicators:
+            log_parser.search_indicators(indicators, output)
+        if args.analytics:
+            LogAnalytics(log_parser).run().print_summary(args.top)
+    finally:
+        if output:
+            output.close()
 
 if __name__ == "__main__":
     main()
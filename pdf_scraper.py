@@ -5,7 +5,50 @@ WORK IN PROGRESS
 
 """
 
+import argparse
+import hashlib
+import json
+import mmap
+import os
 import re
+import sys
+import xml.etree.ElementTree as ET
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+# Patterns compiled once and shared by all BinaryPdfForensics instances
+INFO_REF_PATTERN = re.compile(rb'[/]Info[\s0-9]*?R', re.DOTALL)
+XMP_REF_PATTERN = re.compile(rb'[/]Metadata[\s0-9]*?R', re.DOTALL)
+OBJ_PATTERN = re.compile(rb'(?<![0-9])([0-9]+)[ \t\r\n\f\0]+([0-9]+)[ \t\r\n\f\0]+obj(?![A-Za-z])')
+STARTXREF_PATTERN = re.compile(rb'startxref\s+([0-9]+)')
+XREF_SUBSECTION_PATTERN = re.compile(rb'\s*([0-9]+)[ ]+([0-9]+)[ \t]*\r?\n?')
+XREF_ENTRY_PATTERN = re.compile(rb'([0-9]{10})[ ]([0-9]{5})[ ]([nf])')
+PREV_PATTERN = re.compile(rb'/Prev\s+([0-9]+)')
+ROOT_REF_PATTERN = re.compile(rb'/Root\s+([0-9]+)\s+([0-9]+)\s+R')
+OBJSTM_PATTERN = re.compile(rb'/Type\s*/ObjStm(?![A-Za-z])')
+LENGTH_PATTERN = re.compile(rb'/Length\s+([0-9]+)(?:\s+([0-9]+)\s+R)?')
+FILTER_PATTERN = re.compile(rb'/Filter\s*(\[[^\]]*\]|/[A-Za-z0-9]+)')
+FIRST_PATTERN = re.compile(rb'/First\s+([0-9]+)')
+COUNT_PATTERN = re.compile(rb'/N\s+([0-9]+)')
+INTEGER_PATTERN = re.compile(rb'[0-9]+')
+
+# Streams are inflated in chunks and never beyond MAX_INFLATE_SIZE
+INFLATE_CHUNK_SIZE = 65536
+MAX_INFLATE_SIZE = 64 << 20
+
+PDF_SUFFIX = '.pdf'
+HASH_BLOCK_SIZE = 1 << 20
+CACHE_VERSION = 2
+
+RDF_NS = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+XML_NS = '{http://www.w3.org/XML/1998/namespace}'
+RDF_CONTAINERS = (RDF_NS + 'Seq', RDF_NS + 'Bag', RDF_NS + 'Alt')
+
+# Start and end tags delimiting an XMP packet, in order of preference
+XMP_BOUNDS = ((b'<x:xmpmeta', b'</x:xmpmeta>'),
+              (b'<x:xapmeta', b'</x:xapmeta>'),
+              (b'<rdf:RDF', b'</rdf:RDF>'))
 
 class XMPObject:
     def __init__(self, obj):
@@ -25,6 +68,127 @@ class XMPObject:
     def __str__(self):
         return ''.join([str(i) + " = " + str(self.obj_data[i]) + "\n" for i in self.obj_data.keys()])
 
+class XMPPacket:
+    """Structured view of an XMP packet, parsed in a single pass
+
+    The packet is fed to an incremental XML parser in chunks of a
+    memoryview, so the object is never decoded or split as a whole.
+    Each top-level property of every rdf:Description, in element or
+    attribute form, is converted when its end tag is seen and its
+    subtree is then discarded. Arrays become lists, structures and
+    parseType="Resource" items become dicts, so repeated entries such
+    as the stEvt items of xmpMM:History are all kept.
+
+    Attributes:
+        properties: A dict mapping prefixed property names, such as
+            'xmp:CreateDate', to the list of their values in packet
+            order.
+        error: The XML parsing error message if the packet is
+            malformed, in which case properties holds what was
+            parsed before the error, otherwise None.
+    """
+    def __init__(self, obj, chunk_size=65536):
+        self.properties = {}
+        self.error = None
+        self.prefixes = {}
+        self.parse(obj, chunk_size)
+
+    def parse(self, obj, chunk_size):
+        """Feeds the packet found in obj to the pull parser in chunks"""
+        view = memoryview(obj)
+        for start_tag, end_tag in XMP_BOUNDS:
+            start = obj.find(start_tag)
+            end = obj.rfind(end_tag)
+            if start != -1 and end > start:
+                view = view[start:end + len(end_tag)]
+                break
+        else:
+            self.error = 'no XMP packet found'
+            return
+
+        parser = ET.XMLPullParser(events=('start-ns', 'start', 'end'))
+        stack = []
+        try:
+            for offset in range(0, len(view), chunk_size):
+                parser.feed(view[offset:offset + chunk_size])
+                self.handle_events(parser.read_events(), stack)
+            parser.close()
+            self.handle_events(parser.read_events(), stack)
+        except ET.ParseError as e:
+            self.error = str(e)
+        finally:
+            view.release()
+
+    def handle_events(self, events, stack):
+        """Records the properties completed by a batch of parser events"""
+        for event, item in events:
+            if event == 'start-ns':
+                prefix, uri = item
+                self.prefixes.setdefault('{' + uri + '}', prefix)
+            elif event == 'start':
+                if item.tag == RDF_NS + 'Description' and stack and stack[-1].tag == RDF_NS + 'RDF':
+                    # Attribute-form properties of a top-level description
+                    for name, value in item.attrib.items():
+                        if not name.startswith(RDF_NS) and not name.startswith(XML_NS):
+                            self.add(name, value)
+                stack.append(item)
+            else:
+                stack.pop()
+                if stack and stack[-1].tag == RDF_NS + 'Description' and len(stack) >= 2 \
+                        and stack[-2].tag == RDF_NS + 'RDF':
+                    self.add(item.tag, self.convert(item))
+                    item.clear()
+
+    def convert(self, element):
+        """Converts a property element into a str, list or dict value"""
+        resource = element.get(RDF_NS + 'resource')
+        if resource is not None:
+            return resource
+
+        children = list(element)
+        if element.get(RDF_NS + 'parseType') == 'Resource':
+            return self.convert_fields(element, children)
+        if len(children) == 1 and children[0].tag in RDF_CONTAINERS:
+            return [self.convert(item) for item in children[0]]
+        if len(children) == 1 and children[0].tag == RDF_NS + 'Description':
+            return self.convert_fields(children[0], list(children[0]))
+        if children or self.attributes(element):
+            return self.convert_fields(element, children)
+        return (element.text or '').strip()
+
+    def convert_fields(self, element, children):
+        """Converts a structure into a dict of its field values"""
+        fields = {self.name(name): value for name, value in self.attributes(element)}
+        for child in children:
+            fields[self.name(child.tag)] = self.convert(child)
+        return fields
+
+    def attributes(self, element):
+        """Returns the (name, value) pairs of non-RDF attributes"""
+        return [(name, value) for name, value in element.attrib.items()
+                if not name.startswith(RDF_NS) and not name.startswith(XML_NS)]
+
+    def name(self, tag):
+        """Returns the prefixed name of a namespaced tag"""
+        if tag.startswith('{'):
+            uri, local = tag[1:].split('}', 1)
+            prefix = self.prefixes.get('{' + uri + '}')
+            if prefix:
+                return prefix + ':' + local
+        return tag
+
+    def add(self, tag, value):
+        self.properties.setdefault(self.name(tag), []).append(value)
+
+    def get(self, name, default=None):
+        """Returns the first value of a property, such as 'xmp:CreateDate'"""
+        values = self.properties.get(name)
+        return values[0] if values else default
+
+    def __str__(self):
+        return ''.join(['{} = {}\n'.format(name, value[0] if len(value) == 1 else value)
+                        for name, value in self.properties.items()])
+
 def de_dupe_list(list_var):
     """Removes duplicate elements from list
 
@@ -47,6 +211,40 @@ def de_dupe_list(list_var):
     return new_list
 
 
+def inflate(view, limit=None, max_size=MAX_INFLATE_SIZE, chunk_size=INFLATE_CHUNK_SIZE):
+    """Inflates Flate-encoded data incrementally
+
+    The compressed data is fed to a zlib decompressor in chunks and
+    inflation stops as soon as limit bytes, or at most max_size bytes,
+    were produced, so only the prefix needed by the caller is ever
+    held in memory.
+
+    Args:
+        view: A bytes-like object holding the compressed data.
+        limit: The number of decoded bytes needed, None for all.
+        max_size: Hard cap on the number of decoded bytes.
+        chunk_size: Number of compressed bytes fed at a time.
+
+    Returns:
+        The decoded bytes. Corrupt or truncated data returns what
+        was decoded before the error.
+    """
+    limit = max_size if limit is None else min(limit, max_size)
+    decompressor = zlib.decompressobj()
+    output = []
+    size = 0
+    try:
+        for offset in range(0, len(view), chunk_size):
+            if size >= limit or decompressor.eof:
+                break
+            chunk = decompressor.decompress(view[offset:offset + chunk_size], limit - size)
+            output.append(chunk)
+            size += len(chunk)
+    except zlib.error:
+        pass
+    return b''.join(output)
+
+
 class BinaryPdfForensics:
     def __init__(self, 
                  file_path, 
@@ -56,6 +254,276 @@ class BinaryPdfForensics:
         self.temp_path = self.file_path
         self.output_path = self.file_path
         self.password = password
+        self._data = None
+        self._file = None
+        self._object_index = None
+        self._object_streams = None
+        self._refs = {}
+
+    @property
+    def data(self):
+        """Read-only memory-mapped view of the file, mapped once per instance"""
+        if self._data is None:
+            self._file = open(self.temp_path, 'rb')
+            try:
+                self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                self._data = b''
+        return self._data
+
+    def close(self):
+        """Releases the memory-mapped view of the file"""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file is not None:
+            self._file.close()
+        self._data = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def object_index(self):
+        """Maps (object number, generation) to the byte offset of each object
+
+        The index is built lazily on first use, from the xref tables
+        when they are present, otherwise from a single linear scan for
+        'N G obj' headers. When an object is defined more than once,
+        as with incremental updates, the latest definition is kept.
+        """
+        if self._object_index is None:
+            self._object_index = self._index_from_xref()
+            if self._object_index is None:
+                self._object_index = self._index_from_scan()
+        return self._object_index
+
+    def _index_from_xref(self):
+        """Builds the object index from the classic xref tables
+
+        Returns None if the file has no startxref pointer, uses xref
+        streams or has a malformed table. Entries are checked against
+        the object headers when the objects are read by get_object().
+        """
+        data = self.data
+        startxref = None
+        for startxref in STARTXREF_PATTERN.finditer(data, max(0, len(data) - 1024)):
+            pass
+        if startxref is None:
+            return None
+
+        index = {}
+        offset = int(startxref.group(1))
+        visited = set()
+        while offset not in visited:
+            visited.add(offset)
+            if data[offset:offset + 4] != b'xref':
+                return None
+            position = offset + 4
+            trailer = data.find(b'trailer', position)
+            if trailer == -1:
+                return None
+
+            # Each subsection is a header 'first count' followed by count entries
+            while position < trailer:
+                subsection = XREF_SUBSECTION_PATTERN.match(data, position, trailer)
+                if subsection is None or subsection.end() == position:
+                    break
+                first, count = int(subsection.group(1)), int(subsection.group(2))
+                position = subsection.end()
+                for number in range(first, first + count):
+                    entry = XREF_ENTRY_PATTERN.match(data, position)
+                    if entry is None:
+                        return None
+                    position = entry.end()
+                    while data[position:position + 1] in (b' ', b'\r', b'\n'):
+                        position += 1
+                    key = (number, int(entry.group(2)))
+                    if entry.group(3) == b'n' and key not in index:
+                        index[key] = int(entry.group(1))
+
+            # Older sections of incrementally updated files
+            trailer_end = data.find(b'startxref', trailer)
+            previous = PREV_PATTERN.search(data, trailer, len(data) if trailer_end == -1 else trailer_end)
+            if previous is None:
+                break
+            offset = int(previous.group(1))
+        return index
+
+    def _index_from_scan(self):
+        """Builds the object index with one linear scan of object headers"""
+        return {(int(header.group(1)), int(header.group(2))): header.start()
+                for header in OBJ_PATTERN.finditer(self.data)}
+
+    def get_object(self, number, generation=0, decode=False):
+        """Returns the bytes of an object, from 'N G obj' to 'endobj'
+
+        Objects stored in compressed object streams are returned with
+        a synthesized 'N 0 obj' header and 'endobj' trailer.
+
+        Args:
+            number: The object number.
+            generation: The object generation number.
+            decode: Whether to replace Flate-encoded stream data
+                with the decoded data.
+
+        Returns:
+            The object as bytes, or None if the file does not
+            contain the object.
+        """
+        data = self.data
+        start = self.object_index.get((number, generation))
+        if start is None:
+            return self._get_compressed_object(number) if generation == 0 else None
+
+        # A stale xref entry falls back to an index of the actual headers
+        header = OBJ_PATTERN.match(data, start)
+        if header is None or (int(header.group(1)), int(header.group(2))) != (number, generation):
+            self._object_index = self._index_from_scan()
+            self._object_streams = None
+            start = self._object_index.get((number, generation))
+            if start is None:
+                return self._get_compressed_object(number) if generation == 0 else None
+
+        bounds = self._stream_bounds(start) if decode else None
+        if bounds is not None and FILTER_PATTERN.search(data, start, bounds[0]):
+            decoded = self._decode_stream(start)
+            if decoded is not None:
+                return data[start:bounds[1]] + decoded + b'\nendstream\nendobj'
+
+        end = data.find(b'endobj', start)
+        return data[start:len(data) if end == -1 else end + 6]
+
+    def _stream_bounds(self, start):
+        """Locates the stream data of the object at start
+
+        Returns:
+            A tuple (dictionary end, data start, data end), or None
+            if the object has no stream.
+        """
+        data = self.data
+        keyword = data.find(b'stream', start)
+        end = data.find(b'endobj', start)
+        if keyword == -1 or (end != -1 and keyword > end):
+            return None
+        data_start = keyword + 6
+        if data[data_start:data_start + 2] == b'\r\n':
+            data_start += 2
+        elif data[data_start:data_start + 1] in (b'\r', b'\n'):
+            data_start += 1
+
+        # /Length may be an indirect reference to another object
+        length = None
+        match = LENGTH_PATTERN.search(data, start, keyword)
+        if match is not None and match.group(2) is None:
+            length = int(match.group(1))
+        elif match is not None:
+            obj = self.get_object(int(match.group(1)), int(match.group(2)))
+            numbers = INTEGER_PATTERN.findall(obj.split(b'obj', 1)[1]) if obj else []
+            length = int(numbers[0]) if numbers else None
+        if length is None or data_start + length > len(data):
+            data_end = data.find(b'endstream', data_start)
+            return (keyword, data_start, len(data) if data_end == -1 else data_end)
+        return (keyword, data_start, data_start + length)
+
+    def _decode_stream(self, start, limit=None):
+        """Decodes at most limit bytes of the stream of the object at start
+
+        Returns:
+            The decoded bytes, or None if the object has no stream or
+            uses filters other than a single FlateDecode without a
+            predictor.
+        """
+        bounds = self._stream_bounds(start)
+        if bounds is None:
+            return None
+        dictionary_end, data_start, data_end = bounds
+        data = self.data
+        match = FILTER_PATTERN.search(data, start, dictionary_end)
+        filters = re.findall(rb'/([A-Za-z0-9]+)', match.group(1)) if match else []
+        if not filters:
+            return data[data_start:data_end if limit is None else min(data_end, data_start + limit)]
+        if filters not in ([b'FlateDecode'], [b'Fl']) or data.find(b'/Predictor', start, dictionary_end) != -1:
+            return None
+        view = memoryview(data)[data_start:data_end]
+        try:
+            return inflate(view, limit)
+        finally:
+            view.release()
+
+    @property
+    def object_streams(self):
+        """Maps numbers of compressed objects to their object stream
+
+        Each value is a tuple (stream offset, /First, object offset,
+        next object offset or None). Only the header of each object
+        stream, holding the object numbers and offsets, is inflated.
+        """
+        if self._object_streams is None:
+            data = self.data
+            starts = sorted(self.object_index.values())
+            self._object_streams = {}
+            for match in OBJSTM_PATTERN.finditer(data):
+                position = bisect_right(starts, match.start())
+                if position == 0:
+                    continue
+                start = starts[position - 1]
+                bounds = self._stream_bounds(start)
+                if bounds is None or bounds[0] < match.start():
+                    continue
+                first = FIRST_PATTERN.search(data, start, bounds[0])
+                count = COUNT_PATTERN.search(data, start, bounds[0])
+                if first is None or count is None:
+                    continue
+                first = int(first.group(1))
+                header = self._decode_stream(start, first)
+                numbers = [int(number) for number in INTEGER_PATTERN.findall(header or b'')]
+                pairs = list(zip(numbers[0::2], numbers[1::2]))[:int(count.group(1))]
+                for position, (number, offset) in enumerate(pairs):
+                    following = pairs[position + 1][1] if position + 1 < len(pairs) else None
+                    self._object_streams[number] = (start, first, offset, following)
+        return self._object_streams
+
+    def _get_compressed_object(self, number):
+        """Returns an object stored in an object stream, inflating the
+        stream only up to the end of that object"""
+        entry = self.object_streams.get(number)
+        if entry is None:
+            return None
+        start, first, offset, following = entry
+        body = self._decode_stream(start, None if following is None else first + following)
+        if not body or len(body) <= first + offset:
+            return None
+        body = body[first + offset:] if following is None else body[first + offset:first + following]
+        return b'%d 0 obj\n' % number + body.strip() + b'\nendobj'
+
+    def _find_refs(self, pattern):
+        """Returns the de-duplicated matches of a reference pattern,
+        scanning the file once per pattern and instance"""
+        if pattern not in self._refs:
+            refs = pattern.findall(self.data)
+            # A catalog stored in an object stream is only visible decoded
+            for root in de_dupe_list(ROOT_REF_PATTERN.findall(self.data)):
+                key = (int(root[0]), int(root[1]))
+                if key not in self.object_index:
+                    refs.extend(pattern.findall(self.get_object(*key) or b''))
+            self._refs[pattern] = de_dupe_list(refs)
+        return self._refs[pattern]
+
+    def _get_ref_objs(self, refs):
+        """Maps references such as b'/Info 2 0 R' to their objects"""
+        obj_dict = {}
+        for ref in refs:
+            numbers = re.findall(b'[0-9]+', ref)
+            if len(numbers) != 2:
+                continue
+            obj = self.get_object(int(numbers[0]), int(numbers[1]), decode=True)
+            if obj is not None:
+                obj_dict[ref] = obj
+        return obj_dict
 
     def get_info_ref(self):
         """Tests if a PDF file contains an /Info reference
@@ -81,17 +549,12 @@ class BinaryPdfForensics:
 
                 /Info 2 0 R
         """
-        with open(self.temp_path, 'rb') as raw_file:
-            read_file = raw_file.read()
-            regex = b'[/]Info[\s0-9]*?R'
-            pattern = re.compile(regex, re.DOTALL)
-            info_ref = re.findall(pattern, read_file)
-            info_ref = de_dupe_list(info_ref)
-            if len(info_ref) == 0:
-                info_ref_exists = False
-            else:
-                info_ref_exists = True
-            return (info_ref_exists, info_ref)
+        info_ref = self._find_refs(INFO_REF_PATTERN)
+        if len(info_ref) == 0:
+            info_ref_exists = False
+        else:
+            info_ref_exists = True
+        return (info_ref_exists, info_ref)
         
     def get_xmp_ref(self):
         """Tests if a PDF file contains a /Metadata reference
@@ -116,17 +579,12 @@ class BinaryPdfForensics:
 
                 /Metadata 3 0 R
         """
-        with open(self.temp_path, 'rb') as raw_file:
-            read_file = raw_file.read()
-            regex = b'[/]Metadata[\s0-9]*?R'
-            pattern = re.compile(regex, re.DOTALL)
-            xmp_ref = re.findall(pattern, read_file)
-            xmp_ref = de_dupe_list(xmp_ref)
-            if len(xmp_ref) == 0:
-                xmp_ref_exists = False
-            else:
-                xmp_ref_exists = True
-            return (xmp_ref_exists, xmp_ref)
+        xmp_ref = self._find_refs(XMP_REF_PATTERN)
+        if len(xmp_ref) == 0:
+            xmp_ref_exists = False
+        else:
+            xmp_ref_exists = True
+        return (xmp_ref_exists, xmp_ref)
 
     def get_info_obj(self):
         """Extracts /Info objects from PDF file
@@ -151,27 +609,12 @@ class BinaryPdfForensics:
             /Info object exists, and (2) a dictionary which maps
             the /Info references with their objects.
         """
-        with open(self.temp_path, 'rb') as raw_file:
-            read_file = raw_file.read()
-            info_ref_tuple = BinaryPdfForensics.get_info_ref(self)
-            info_obj_dict = {}
-            for ref in info_ref_tuple[1]:
-                info_ref = ref.decode()
-                info_ref = info_ref.replace('/Info ', '') \
-                                   .replace(' R', '')
-                info_ref = str.encode(info_ref)
-                regex = b'[^0-9]' + info_ref + b'[ ]obj.*?endobj'
-                pattern = re.compile(regex, re.DOTALL)
-                info_obj = re.findall(pattern, read_file)
-                info_obj = de_dupe_list(info_obj)
-                if len(info_obj) > 0:
-                    for obj in info_obj:
-                        info_obj_dict[ref] = obj
-            if len(info_obj_dict) == 0:
-                info_obj_exists = False
-            else:
-                info_obj_exists = True
-            return (info_obj_exists, info_obj_dict)
+        info_obj_dict = self._get_ref_objs(self.get_info_ref()[1])
+        if len(info_obj_dict) == 0:
+            info_obj_exists = False
+        else:
+            info_obj_exists = True
+        return (info_obj_exists, info_obj_dict)
         
     def get_xmp_obj(self):
         """Extracts /Metadata objects from PDF file
@@ -201,35 +644,212 @@ class BinaryPdfForensics:
             /Metadata object exists, and (2) a dictionary which 
             maps the /Metadata references with their objects.
         """
-        with open(self.temp_path, 'rb') as raw_file:
-            read_file = raw_file.read()
-            xmp_ref_tuple = BinaryPdfForensics.get_xmp_ref(self)
-            xmp_obj_dict = {}
-            for ref in xmp_ref_tuple[1]:
-                xmp_ref = ref.decode()
-                xmp_ref = xmp_ref.replace('/Metadata ', '') \
-                                 .replace(' R', '')
-                xmp_ref = str.encode(xmp_ref)
-                regex = b'[^0-9]' + xmp_ref + b'[ ]obj.*?endobj'
-                pattern = re.compile(regex, re.DOTALL)
-                xmp_obj = re.findall(pattern, read_file)
-                xmp_obj = de_dupe_list(xmp_obj)
-                if len(xmp_obj) > 0:
-                    for obj in xmp_obj:
-                        xmp_obj_dict[ref] = obj
-            if len(xmp_obj_dict) == 0:
-                xmp_obj_exists = False
-            else:
-                xmp_obj_exists = True
-            return (xmp_obj_exists, xmp_obj_dict)
+        xmp_obj_dict = self._get_ref_objs(self.get_xmp_ref()[1])
+        if len(xmp_obj_dict) == 0:
+            xmp_obj_exists = False
+        else:
+            xmp_obj_exists = True
+        return (xmp_obj_exists, xmp_obj_dict)
+
+
+
+def iter_pdf_paths(paths):
+    """Yields the PDF files found under a list of files and directories
+
+    Directories are walked recursively in a stable, sorted order and
+    only files with a .pdf suffix are kept. Files passed explicitly
+    are yielded whatever their suffix.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(PDF_SUFFIX):
+                    yield os.path.join(root, name)
+
+
+def file_key(file_path, content_hash=False):
+    """Returns the cache key of a file
+
+    By default the key is built from the device, inode, size and
+    modification time, which needs a single stat call. With
+    content_hash the file is hashed in blocks instead, so renamed and
+    copied files still hit the cache.
+    """
+    if content_hash:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        return 'blake2b:' + digest.hexdigest()
+    stat = os.stat(file_path)
+    return 'stat:{}:{}:{}:{}'.format(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
 
+def safe_file_key(file_path, content_hash=False):
+    """Returns the cache key of a file, or None if it cannot be read"""
+    try:
+        return file_key(file_path, content_hash)
+    except OSError:
+        return None
+
+
+def analyze_pdf(file_path):
+    """Runs the forensics checks on a single PDF
+
+    Module-level so it can be pickled to worker processes.
+
+    Returns:
+        A JSON-serialisable dict with the path, the decoded /Info
+        objects and the parsed XMP packets keyed by reference, and
+        an error message when the file could not be read.
+    """
+    record = {'path': file_path, 'info': {}, 'xmp': {}, 'error': None}
+    try:
+        with BinaryPdfForensics(file_path) as pdf:
+            for ref, obj in pdf.get_info_obj()[1].items():
+                record['info'][ref.decode('latin-1')] = obj.decode('latin-1')
+            for ref, obj in pdf.get_xmp_obj()[1].items():
+                packet = XMPPacket(obj)
+                record['xmp'][ref.decode('latin-1')] = {'properties': packet.properties,
+                                                        'error': packet.error}
+    except (OSError, ValueError) as e:
+        record['error'] = str(e)
+    return record
+
+
+class ResultCache:
+    """Persistent JSON cache of analysis results keyed by file_key()
+
+    The cache is loaded once and written back atomically through a
+    temporary file, so an interrupted run never leaves a truncated
+    cache behind.
+
+    Attributes:
+        cache_path(string): JSON file holding the cached results, optional
+        entries(dict): Maps cache keys to analysis results
+        dirty(bool): Whether entries changed since the last save
+    """
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.dirty = False
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as file:
+                cache = json.load(file)
+            if cache.get('version') == CACHE_VERSION:
+                self.entries = cache['entries']
+
+    def get(self, key):
+        return self.entries.get(key) if key is not None else None
+
+    def put(self, key, record):
+        """Caches a result; unreadable files and failed analyses are not cached"""
+        if key is None or record['error'] is not None:
+            return
+        self.entries[key] = {name: value for name, value in record.items() if name != 'path'}
+        self.dirty = True
+
+    def save(self):
+        """Writes the cache back if it changed"""
+        if not self.cache_path or not self.dirty:
+            return
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'version': CACHE_VERSION, 'entries': self.entries}, file)
+        os.replace(temp_path, self.cache_path)
+        self.dirty = False
+
+
+class BatchPdfForensics:
+    """
+    Runs BinaryPdfForensics over directory trees in a process pool
+
+    Attributes:
+        paths(list): PDF files and directories to analyze
+        workers(int): Number of worker processes
+        cache(ResultCache): Results of previously analyzed files
+        content_hash(bool): Key the cache by content hash rather than by stat
+
+    Methods:
+        run(): Yields one result dict per PDF file
+        write(output): Writes the results as JSON lines
+    """
+    def __init__(self, paths, workers=None, cache_path=None, content_hash=False):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = ResultCache(cache_path)
+        self.content_hash = content_hash
+
+    def run(self):
+        """Yields a result dict per PDF file
+
+        Cached results are yielded as soon as their key is known;
+        the remaining files are analyzed in the pool and yielded in
+        walk order. The cache is saved once the run ends, including
+        when the generator is closed early.
+        """
+        file_paths = list(iter_pdf_paths(self.paths))
+        chunksize = max(1, len(file_paths) // (self.workers * 4))
+        try:
+            with ProcessPoolExecutor(self.workers) as executor:
+                if self.content_hash:
+                    keys = list(executor.map(safe_file_key, file_paths,
+                                             [True] * len(file_paths), chunksize=chunksize))
+                else:
+                    keys = [safe_file_key(file_path) for file_path in file_paths]
+
+                pending = []
+                for file_path, key in zip(file_paths, keys):
+                    cached = self.cache.get(key)
+                    if cached is None:
+                        pending.append((file_path, key))
+                    else:
+                        yield dict({'path': file_path}, **cached)
+
+                if pending:
+                    records = executor.map(analyze_pdf, [file_path for file_path, _ in pending],
+                                           chunksize=max(1, len(pending) // (self.workers * 4)))
+                    for (_, key), record in zip(pending, records):
+                        self.cache.put(key, record)
+                        yield record
+        finally:
+            self.cache.save()
+
+    def write(self, output=None):
+        """Writes one JSON object per line to output, or to stdout"""
+        file = open(output, 'w') if output else sys.stdout
+        try:
+            for record in self.run():
+                file.write(json.dumps(record) + '\n')
+        finally:
+            if output:
+                file.close()
 
 
 def main():
-    results = BinaryPdfForensics(file_path='data/pdf5.pdf').get_xmp_obj()
-    for xmp_key in results[1]:
-        print("Results for XMP {}".format(xmp_key.decode()))
-        print(XMPObject(results[1][xmp_key]))
+    """Main program entry point"""
+    parser = argparse.ArgumentParser(description="Extracts /Info and XMP metadata from PDF files")
+    parser.add_argument("-f", "--file", help="PDF file to analyze", default='data/pdf5.pdf')
+    parser.add_argument("-d", "--directory", nargs='+', help="Directories or files to analyze in batch, as JSON lines")
+    parser.add_argument("-w", "--workers", help="Number of worker processes in batch mode", type=int, default=None)
+    parser.add_argument("-c", "--cache", help="JSON cache of results, re-scanned files skip extraction", required=False)
+    parser.add_argument("--hash", help="Key the cache by content hash instead of size, mtime and inode", action='store_true')
+    parser.add_argument("-o", "--output", help="Write the JSON lines to a file instead of stdout", required=False)
+    args = parser.parse_args()
+
+    if args.directory:
+        BatchPdfForensics(args.directory, args.workers, args.cache, args.hash).write(args.output)
+        return
+
+    with BinaryPdfForensics(file_path=args.file) as pdf:
+        results = pdf.get_xmp_obj()
+        for xmp_key in results[1]:
+            print("Results for XMP {}".format(xmp_key.decode()))
+            print(XMPPacket(results[1][xmp_key]))
 
 
 if __name__ == '__main__':
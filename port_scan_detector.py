@@ -12,7 +12,454 @@ WORK IN PROGRESS
 """
 
 import argparse
+import mmap, os, struct, sys, time
 import dpkt, socket
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Classic libpcap global header magic numbers (microsecond and nanosecond)
+PCAP_MAGIC = {b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>',
+              b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>'}
+PCAP_NANOSECOND_MAGIC = (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+PCAP_HEADER_SIZE = 24
+PCAP_RECORD_SIZE = 16
+
+# pcapng block types and markers
+PCAPNG_SECTION_HEADER = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER_LITTLE = b'\x4d\x3c\x2b\x1a'
+PCAPNG_INTERFACE_DESCRIPTION = 1
+PCAPNG_PACKET = 2
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_OPTION_TSRESOL = 9
+
+# Link types. Raw IP and loopback link types map to the offset of the IP
+# header, whose version is read from its first nibble
+LINKTYPE_ETHERNET = 1
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+LINKTYPE_IP_OFFSET = {0: 4, 12: 0, 14: 0, 101: 0, 108: 4, 228: 0, 229: 0}
+
+ETH_TYPE_VLAN = (0x8100, 0x88A8)
+ETH_TYPE_VERSION = {0x0800: 4, 0x86DD: 6}
+IP_PROTO_TCP = 6
+IP_PROTO_FRAGMENT = 44
+IP_PROTO_AH = 51
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+# TCP flag byte values of a bare SYN and a SYN-ACK
+TCP_SYN = dpkt.tcp.TH_SYN
+TCP_SYN_ACK = dpkt.tcp.TH_SYN | dpkt.tcp.TH_ACK
+
+# Parallel mode splits captures into shards of about this many bytes. Shard
+# starts are resynchronised on this many consecutive plausible record headers
+SHARD_SIZE = 64 << 20
+RESYNC_RECORDS = 8
+
+# IPv6 host keys are the 128-bit address with this bit set, IPv4 host keys
+# are the plain 32-bit address
+IPV6_KEY = 1 << 128
+
+def format_ip(ip):
+    """Returns the printable form of an integer host key"""
+    if ip >= IPV6_KEY:
+        return socket.inet_ntop(socket.AF_INET6, (ip ^ IPV6_KEY).to_bytes(16, 'big'))
+    return socket.inet_ntoa(ip.to_bytes(4, 'big'))
+
+def decode_raw_ip(buf):
+    """Decodes a raw IP packet with dpkt, by the version in its first nibble"""
+    return (dpkt.ip6.IP6 if buf[:1] and buf[0] >> 4 == 6 else dpkt.ip.IP)(buf)
+
+# dpkt decoders returning the network layer of a frame, by link type. Frames
+# of other link types are counted but not decoded
+DPKT_NETWORK_LAYER = {
+    LINKTYPE_ETHERNET: lambda buf: dpkt.ethernet.Ethernet(buf).data,
+    LINKTYPE_LINUX_SLL: lambda buf: dpkt.sll.SLL(buf).data,
+    LINKTYPE_LINUX_SLL2: lambda buf: dpkt.sll2.SLL2(buf).data,
+}
+for linktype, offset in LINKTYPE_IP_OFFSET.items():
+    DPKT_NETWORK_LAYER[linktype] = (lambda buf: dpkt.loopback.Loopback(buf).data) if offset else decode_raw_ip
+
+UNPACK_ETHERTYPE = struct.Struct('>H').unpack_from
+UNPACK_IPS = struct.Struct('>II').unpack_from
+UNPACK_IPV6 = struct.Struct('>QQQQ').unpack_from
+
+def decode_tcp(buf, start, end, linktype=LINKTYPE_ETHERNET):
+    """
+    Decode the frame in buf[start:end] at fixed header offsets. Return
+    (TCP flag byte, offset of the IP header, IP version) for unfragmented
+    IPv4 and IPv6 TCP packets, or (None, None, None) for anything else.
+    """
+    # Find the network layer protocol and header
+    if linktype == LINKTYPE_ETHERNET:
+        # Skip any 802.1Q/802.1ad tags
+        ip = start + 14
+        if ip > end:
+            return None, None, None
+        ethertype = UNPACK_ETHERTYPE(buf, ip - 2)[0]
+        while ethertype in ETH_TYPE_VLAN and ip + 4 <= end:
+            ethertype = UNPACK_ETHERTYPE(buf, ip + 2)[0]
+            ip += 4
+        version = ETH_TYPE_VERSION.get(ethertype)
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ip = start + 16
+        version = ETH_TYPE_VERSION.get(UNPACK_ETHERTYPE(buf, start + 14)[0]) if ip <= end else None
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ip = start + 20
+        version = ETH_TYPE_VERSION.get(UNPACK_ETHERTYPE(buf, start)[0]) if ip <= end else None
+    elif linktype in LINKTYPE_IP_OFFSET:
+        ip = start + LINKTYPE_IP_OFFSET[linktype]
+        version = buf[ip] >> 4 if ip < end else None
+    else:
+        return None, None, None
+
+    if version == 4:
+        # Unfragmented TCP only, as dpkt would decode it
+        if ip + 20 > end or buf[ip + 9] != IP_PROTO_TCP or (buf[ip + 6] & 0x1F or buf[ip + 7]):
+            return None, None, None
+        header_length = (buf[ip] & 0x0F) * 4
+        tcp = ip + header_length
+        if header_length < 20 or tcp + 20 > end:
+            return None, None, None
+        return buf[tcp + 13], ip, 4
+
+    if version == 6:
+        if ip + 40 > end:
+            return None, None, None
+
+        # Walk the extension header chain to the TCP header
+        next_header = buf[ip + 6]
+        tcp = ip + 40
+        while next_header != IP_PROTO_TCP:
+            if tcp + 8 > end:
+                return None, None, None
+            if next_header in IPV6_EXTENSION_HEADERS:
+                length = (buf[tcp + 1] + 1) * 8
+            elif next_header == IP_PROTO_FRAGMENT and not (buf[tcp + 2] << 8 | buf[tcp + 3]) & 0xFFF8:
+                length = 8
+            elif next_header == IP_PROTO_AH:
+                length = (buf[tcp + 1] + 2) * 4
+            else:
+                return None, None, None
+            next_header = buf[tcp]
+            tcp += length
+        if tcp + 20 > end:
+            return None, None, None
+        return buf[tcp + 13], ip, 6
+
+    return None, None, None
+
+def host_keys(buf, ip, version):
+    """
+    Return the (source, destination) integer host keys of the IP header at ip.
+    """
+    if version == 4:
+        return UNPACK_IPS(buf, ip + 12)
+    source_high, source_low, destination_high, destination_low = UNPACK_IPV6(buf, ip + 8)
+    return (IPV6_KEY | source_high << 64 | source_low,
+            IPV6_KEY | destination_high << 64 | destination_low)
+
+def iter_records(buf):
+    """
+    Iterate over the packets of a classic libpcap or pcapng capture buffer,
+    e.g. a memory map, yielding (link type, timestamp, memoryview) tuples.
+    The memoryviews are zero-copy slices of buf, and must be released before
+    buf is closed. Timestamps are None for pcapng simple packet blocks.
+    Raise ValueError if buf holds neither format.
+    """
+    with memoryview(buf) as view:
+        if view[:4] in PCAP_MAGIC:
+            yield from iter_pcap_records(view)
+        elif view[:4] == PCAPNG_SECTION_HEADER:
+            yield from iter_pcapng_records(view)
+        else:
+            raise ValueError("Unknown capture format")
+
+def iter_pcap_records(view):
+    """
+    Iterate over the packets of a classic libpcap capture memoryview.
+    """
+    magic = bytes(view[:4])
+    endian = PCAP_MAGIC[magic]
+    subsecond = 1e-9 if magic in PCAP_NANOSECOND_MAGIC else 1e-6
+    linktype = struct.unpack_from(endian + 'I', view, 20)[0] & 0xFFFF
+    record_header = struct.Struct(endian + 'IIII').unpack_from
+    size = len(view)
+    offset = PCAP_HEADER_SIZE
+
+    while offset + PCAP_RECORD_SIZE <= size:
+        seconds, fraction, length, _ = record_header(view, offset)
+        start = offset + PCAP_RECORD_SIZE
+        offset = start + length
+        if offset > size:
+            break
+        yield linktype, seconds + fraction * subsecond, view[start:offset]
+
+def iter_pcapng_records(view):
+    """
+    Iterate over the packets of a pcapng capture memoryview. Enhanced,
+    simple and obsolete packet blocks are read. Each section header resets
+    the byte order and the interfaces, whose link types and timestamp
+    resolutions come from interface description blocks.
+    """
+    size = len(view)
+    offset = 0
+    endian = '<'
+    interfaces = []
+
+    while offset + 12 <= size:
+        if view[offset:offset + 4] == PCAPNG_SECTION_HEADER:
+            endian = '<' if view[offset + 8:offset + 12] == PCAPNG_BYTE_ORDER_LITTLE else '>'
+            interfaces = []
+        block_type, block_length = struct.unpack_from(endian + 'II', view, offset)
+        if block_length < 12 or offset + block_length > size:
+            break
+        body = offset + 8
+
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            linktype = struct.unpack_from(endian + 'H', view, body)[0]
+            interfaces.append((linktype, pcapng_resolution(view, body + 8, offset + block_length - 4, endian)))
+        elif block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_PACKET):
+            if block_type == PCAPNG_ENHANCED_PACKET:
+                interface, high, low, length = struct.unpack_from(endian + 'IIII', view, body)
+            else:
+                interface, _, high, low, length = struct.unpack_from(endian + 'HHIII', view, body)
+            start = body + 20
+            if interface < len(interfaces) and start + length <= offset + block_length:
+                linktype, resolution = interfaces[interface]
+                yield linktype, (high << 32 | low) * resolution, view[start:start + length]
+        elif block_type == PCAPNG_SIMPLE_PACKET and interfaces:
+            start = body + 4
+            length = min(struct.unpack_from(endian + 'I', view, body)[0], offset + block_length - 4 - start)
+            yield interfaces[0][0], None, view[start:start + length]
+
+        offset += block_length
+
+def pcapng_resolution(view, offset, end, endian):
+    """
+    Return the timestamp resolution in seconds from the if_tsresol option of
+    an interface description block, defaulting to microseconds.
+    """
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', view, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+            value = view[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+def read_pcap_header(buf):
+    """
+    Return (endian, snaplen) of a classic libpcap Ethernet capture, or None
+    if the buffer holds any other format or link type.
+    """
+    if len(buf) < PCAP_HEADER_SIZE or buf[:4] not in PCAP_MAGIC:
+        return None
+    endian = PCAP_MAGIC[buf[:4]]
+    snaplen, linktype = struct.unpack_from(endian + 'II', buf, 16)
+    if linktype & 0xFFFF != LINKTYPE_ETHERNET:
+        return None
+    return endian, snaplen
+
+def find_record(buf, offset, end, endian, snaplen):
+    """
+    Return the first offset in [offset, end) where RESYNC_RECORDS plausible
+    record headers chain together (or run exactly to the end of the buffer),
+    or None if there is none.
+    """
+    record_header = struct.Struct(endian + 'IIII').unpack_from
+    size = len(buf)
+    limit = max(snaplen, 0xFFFF)
+
+    def plausible(position):
+        _, subsecond, length, original_length = record_header(buf, position)
+        return subsecond < 1000000000 and length <= limit and length <= original_length
+
+    for candidate in range(offset, min(end, size - PCAP_RECORD_SIZE + 1)):
+        position = candidate
+        for _ in range(RESYNC_RECORDS):
+            if position == size:
+                break
+            if position + PCAP_RECORD_SIZE > size or not plausible(position):
+                position = None
+                break
+            position += PCAP_RECORD_SIZE + record_header(buf, position)[2]
+            if position > size:
+                position = None
+                break
+        if position is not None:
+            return candidate
+    return None
+
+def analyze_shard(pcap_file, start, end, exact, fast, compact=False):
+    """
+    Process pool task counting the SYNs and SYN-ACKs of one shard. A shard
+    is either a whole capture (start is None) or the records of a classic
+    capture starting in [start, end). Unless exact, the first record is
+    located with find_record(). Return (first record offset, offset after
+    the last record, packet count, host counts).
+    """
+    analyzer = PacketAnalyzer(pcap_file, 1, fast=fast, compact=compact)
+    if start is None:
+        analyzer.analyze_file(pcap_file)
+        return None, None, analyzer.packet_count, analyzer.host_counts
+
+    with open(pcap_file, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            endian, snaplen = read_pcap_header(buf)
+            first = start if exact else find_record(buf, start, end, endian, snaplen)
+            if first is None:
+                return None, None, 0, HostCounters()
+
+            # A wrong resync can decode garbage, the parent recounts such shards
+            try:
+                stop = analyzer.analyze_records(buf, first, end, endian)
+            except Exception:
+                if exact:
+                    raise
+                return None, None, 0, HostCounters()
+    return first, stop, analyzer.packet_count, analyzer.host_counts
+
+class HostCounters(dict):
+    """
+    Default per-host counters: a dict of host key -> [SYNs, SYN-ACKs].
+    """
+    def add(self, ip, syn, syn_ack):
+        counts = self.get(ip)
+        if counts is None:
+            self[ip] = [syn, syn_ack]
+        else:
+            counts[0] += syn
+            counts[1] += syn_ack
+
+class HostCounterTable:
+    """
+    Compact per-host counters for captures with millions of (often spoofed)
+    sources. Hosts are stored densely, in first-seen order, in parallel typed
+    arrays of 32-bit keys and 32-bit SYN and SYN-ACK counters, and found
+    through an open-addressing index of entry numbers. A host costs about
+    20 bytes instead of the ~150 bytes of a dict entry holding a list.
+    The key of an IPv6 host is the row of its address in a second pair of
+    64-bit arrays holding the high and low halves, flagged per entry.
+    Exposes the add/items/len/in interface of HostCounters.
+    """
+    def __init__(self, capacity=1024):
+        self.keys = array('I')
+        self.ipv6 = bytearray()
+        self.syns = array('I')
+        self.syn_acks = array('I')
+        self.ipv6_high = array('Q')
+        self.ipv6_low = array('Q')
+        self.resize(capacity)
+
+    def resize(self, capacity):
+        """
+        Rebuild the index with capacity slots, a power of two.
+        """
+        self.bits = capacity.bit_length() - 1
+        self.mask = capacity - 1
+        self.index = array('i', [-1]) * capacity
+        keys = map(self.key, range(len(self.keys))) if self.ipv6_low else self.keys
+        for entry, ip in enumerate(keys):
+            slot = self.slot(ip)
+            while self.index[slot] != -1:
+                slot = (slot + 1) & self.mask
+            self.index[slot] = entry
+
+    def slot(self, ip):
+        # Fibonacci hashing spreads sequential addresses across the index,
+        # IPv6 halves are folded together first
+        if ip >= IPV6_KEY:
+            ip = (ip >> 64) ^ ip
+        return ((ip * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - self.bits)
+
+    def key(self, entry):
+        """
+        Return the integer key of an entry, as built by host_keys().
+        """
+        if self.ipv6[entry]:
+            row = self.keys[entry]
+            return IPV6_KEY | self.ipv6_high[row] << 64 | self.ipv6_low[row]
+        return self.keys[entry]
+
+    def find(self, ip):
+        """
+        Return the entry number and index slot of a host, or -1 and the free
+        slot it would take if it is not tracked.
+        """
+        index, keys, ipv6, mask = self.index, self.keys, self.ipv6, self.mask
+        slot = self.slot(ip)
+        if ip < IPV6_KEY:
+            while True:
+                entry = index[slot]
+                if entry == -1 or (keys[entry] == ip and not ipv6[entry]):
+                    return entry, slot
+                slot = (slot + 1) & mask
+
+        high, low = (ip >> 64) & 0xFFFFFFFFFFFFFFFF, ip & 0xFFFFFFFFFFFFFFFF
+        while True:
+            entry = index[slot]
+            if entry == -1:
+                return entry, slot
+            if ipv6[entry] and self.ipv6_low[keys[entry]] == low and self.ipv6_high[keys[entry]] == high:
+                return entry, slot
+            slot = (slot + 1) & mask
+
+    def add(self, ip, syn, syn_ack):
+        if ip < IPV6_KEY:
+            # Inlined IPv4 lookup, the common case
+            index, keys, ipv6, mask = self.index, self.keys, self.ipv6, self.mask
+            slot = ((ip * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - self.bits)
+            while True:
+                entry = index[slot]
+                if entry == -1:
+                    break
+                if keys[entry] == ip and not ipv6[entry]:
+                    self.syns[entry] += syn
+                    self.syn_acks[entry] += syn_ack
+                    return
+                slot = (slot + 1) & mask
+        else:
+            entry, slot = self.find(ip)
+            if entry != -1:
+                self.syns[entry] += syn
+                self.syn_acks[entry] += syn_ack
+                return
+
+        self.index[slot] = len(self.keys)
+        if ip >= IPV6_KEY:
+            self.keys.append(len(self.ipv6_low))
+            self.ipv6.append(1)
+            self.ipv6_high.append((ip >> 64) & 0xFFFFFFFFFFFFFFFF)
+            self.ipv6_low.append(ip & 0xFFFFFFFFFFFFFFFF)
+        else:
+            self.keys.append(ip)
+            self.ipv6.append(0)
+        self.syns.append(syn)
+        self.syn_acks.append(syn_ack)
+
+        # Keep the index at most three quarters full
+        if len(self.keys) * 4 > len(self.index) * 3:
+            self.resize(len(self.index) * 2)
+
+    def items(self):
+        return ((self.key(entry), (syn, syn_ack))
+                for entry, (syn, syn_ack) in enumerate(zip(self.syns, self.syn_acks)))
+
+    def __contains__(self, ip):
+        return self.find(ip)[0] != -1
+
+    def __getitem__(self, ip):
+        entry = self.find(ip)[0]
+        if entry == -1:
+            raise KeyError(ip)
+        return [self.syns[entry], self.syn_acks[entry]]
+
+    def __len__(self):
+        return len(self.keys)
 
 class TcpPacket:
     def __init__(self, tcp):
@@ -40,15 +487,16 @@ class TcpPacket:
         return self.packet_flags
 
 class PacketAnalyzer:
-    def __init__(self, pcap_file, ratio):
+    def __init__(self, pcap_file, ratio, fast=False, workers=1, compact=False):
         
-        try:
-            self.pcap = dpkt.pcap.Reader(open(pcap_file, 'rb'))
-        except (IOError, KeyError):
-            print("Cannot open PCAP file")
+        # One capture or a list of captures analyzed as a whole
+        self.pcap_files = [pcap_file] if isinstance(pcap_file, str) else list(pcap_file)
+        self.fast = fast
+        self.workers = workers
 
         self.ratio = float(ratio)
-        self.suspect_ips = dict()
+        self.compact = compact
+        self.host_counts = HostCounterTable() if compact else HostCounters()
         self.packet_count = 0
 
     def compare_ips(self, ip1, ip2):
@@ -58,69 +506,358 @@ class PacketAnalyzer:
         return sum(map(int, ip1.split('.'))) - sum(map(int, ip2.split('.')))
 
     def analyze(self):
-        for _, buf in self.pcap:
-            self.packet_count += 1
+        if self.workers > 1:
+            self.parallel_analyze()
+        else:
+            for pcap_file in self.pcap_files:
+                self.analyze_file(pcap_file)
+
+        self.print_results()
 
-            # ignore malformed packets
+    def analyze_file(self, pcap_file):
+        # The fast decoder only handles classic Ethernet captures, anything
+        # else goes through the full dpkt decoding path
+        if not (self.fast and self.fast_analyze(pcap_file)):
+            self.dpkt_analyze(pcap_file)
+
+    def parallel_analyze(self):
+        """
+        Shard the captures by file and by record-aligned byte ranges, count
+        each shard in a process pool and merge the partial counters in
+        capture order, so the suspects match a serial run exactly.
+        """
+        tasks = []
+        for pcap_file in self.pcap_files:
             try:
-                eth = dpkt.ethernet.Ethernet(buf)
-            except (dpkt.dpkt.UnpackError, IndexError):
+                with open(pcap_file, 'rb') as file:
+                    header = read_pcap_header(file.read(PCAP_HEADER_SIZE))
+                size = os.path.getsize(pcap_file)
+            except OSError:
+                print("Cannot open PCAP file")
                 continue
-
-            # Packet must include IP protocol to get TCP
-            ip = eth.data
-            if not ip:
+            if header is None or size <= SHARD_SIZE:
+                tasks.append((pcap_file, None, None))
                 continue
+            for start in range(PCAP_HEADER_SIZE, size, SHARD_SIZE):
+                tasks.append((pcap_file, start, min(start + SHARD_SIZE, size)))
+
+        if not tasks:
+            return
+
+        with ProcessPoolExecutor(self.workers) as executor:
+            files, starts, ends = zip(*tasks)
+            exact = [start == PCAP_HEADER_SIZE for start in starts]
+            results = executor.map(analyze_shard, files, starts, ends, exact,
+                                   [self.fast] * len(tasks), [self.compact] * len(tasks))
+
+            expected = None
+            for (pcap_file, start, end), (first, stop, packet_count, host_counts) in zip(tasks, results):
+                if start == PCAP_HEADER_SIZE:
+                    expected = start
+
+                # A shard whose resync disagrees with where the previous shard
+                # stopped is recounted from the correct record boundary
+                if start is not None and first != expected:
+                    first, stop, packet_count, host_counts = analyze_shard(pcap_file, expected, end, True,
+                                                                           self.fast, self.compact)
+                if start is not None:
+                    expected = stop
+
+                self.merge(packet_count, host_counts)
+
+    def merge(self, packet_count, host_counts):
+        """
+        Add partial counters, preserving the order in which hosts were first seen.
+        """
+        self.packet_count += packet_count
+        for ip, (syn, syn_ack) in host_counts.items():
+            self.host_counts.add(ip, syn, syn_ack)
+
+    def fast_analyze(self, pcap_file):
+        """
+        Count SYNs and SYN-ACKs by reading pcap records and link/IP/TCP
+        header fields at fixed offsets of a memory-mapped capture. Hosts are
+        keyed by integers. pcapng and other link types than Ethernet go
+        through iter_records(). Return False, without counting anything, if
+        the capture is neither classic libpcap nor pcapng. A missing or empty
+        file is reported like dpkt_analyze() does.
+        """
+        try:
+            with open(pcap_file, 'rb') as file:
+                buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            print("Cannot open PCAP file")
+            return True
+
+        with buf:
+            header = read_pcap_header(buf)
+            if header is not None:
+                self.analyze_records(buf, PCAP_HEADER_SIZE, len(buf), header[0])
+                return True
+            if buf[:4] not in PCAP_MAGIC and buf[:4] != PCAPNG_SECTION_HEADER:
+                return False
+            self.analyze_views(iter_records(buf))
+        return True
 
-            # Skip packets that are not TCP
-            tcp = ip.data
-            if type(tcp) != dpkt.tcp.TCP:
+    def analyze_views(self, records):
+        """
+        Count the packets yielded by iter_records(). Packets of link types
+        decode_tcp() does not know are counted but not decoded.
+        """
+        add = self.host_counts.add
+        for linktype, _, packet in records:
+            self.packet_count += 1
+            flags, ip, version = decode_tcp(packet, 0, len(packet), linktype)
+            if flags == TCP_SYN:
+                add(host_keys(packet, ip, version)[0], 1, 0)
+            elif flags == TCP_SYN_ACK:
+                add(host_keys(packet, ip, version)[1], 0, 1)
+
+    def analyze_records(self, buf, offset, stop, endian):
+        """
+        Count the records of a classic Ethernet capture buffer that start in
+        [offset, stop). Return the offset following the last counted record.
+        """
+        record_length = struct.Struct(endian + 'I').unpack_from
+        add = self.host_counts.add
+        fast = self.fast
+        size = len(buf)
+        packet_count = 0
+
+        while offset < stop and offset + PCAP_RECORD_SIZE <= size:
+            length = record_length(buf, offset + 8)[0]
+            start = offset + PCAP_RECORD_SIZE
+            end = start + length
+            if end > size:
+                offset = size
+                break
+            offset = end
+            packet_count += 1
+
+            if not fast:
+                self.count_packet(buf[start:end])
                 continue
 
-            # Grab all flags in this TCP packet
-            tcp_flags = TcpPacket(tcp).return_flags()
+            # Fingerprint possible suspects with integer flag masks
+            flags, ip, version = decode_tcp(buf, start, end)
+            if flags == TCP_SYN:
+                add(host_keys(buf, ip, version)[0], 1, 0)
+            elif flags == TCP_SYN_ACK:
+                add(host_keys(buf, ip, version)[1], 0, 1)
 
-            source_ip = socket.inet_ntoa(ip.src)
-            destination_ip = socket.inet_ntoa(ip.dst)
+        self.packet_count += packet_count
+        return offset
 
-            # Fingerprint possible suspects.
-            if {'SYN'} == set(tcp_flags):          # A 'SYN' request.
-                if source_ip not in self.suspect_ips:
-                    self.suspect_ips[source_ip] = {'SYN': 0, 'SYN-ACK': 0}
-                self.suspect_ips[source_ip]['SYN'] += 1
-            elif {'SYN', 'ACK'} == set(tcp_flags): # A 'SYN-ACK' reply.
-                if destination_ip not in self.suspect_ips: 
-                    self.suspect_ips[destination_ip] = {'SYN': 0, 'SYN-ACK': 0}
-                self.suspect_ips[destination_ip]['SYN-ACK'] += 1
+    def dpkt_analyze(self, pcap_file):
+        try:
+            pcap = dpkt.pcap.UniversalReader(open(pcap_file, 'rb'))
+        except (IOError, KeyError, ValueError, dpkt.dpkt.UnpackError):
+            print("Cannot open PCAP file")
+            return
 
-            # Prune unlikely suspects based on ratio of SYNs to SYN-ACKs.
-            for ip in list(self.suspect_ips):
-                if self.suspect_ips[ip]['SYN'] < (self.suspect_ips[ip]['SYN-ACK'] * self.ratio):
-                    del self.suspect_ips[ip]
+        # Decode the link layer the capture declares
+        network_layer = DPKT_NETWORK_LAYER.get(pcap.datalink())
+        try:
+            for _, buf in pcap:
+                self.packet_count += 1
+                if network_layer is not None:
+                    self.count_packet(buf, network_layer)
+        except (dpkt.dpkt.UnpackError, ValueError):
+            # A truncated or corrupted block ends the capture, keeping the
+            # counts so far like the classic path does
+            pass
 
-        self.print_results()
+    def count_packet(self, buf, network_layer=DPKT_NETWORK_LAYER[LINKTYPE_ETHERNET]):
+        # ignore malformed packets
+        try:
+            ip = network_layer(buf)
+        except (dpkt.dpkt.UnpackError, IndexError):
+            return
+
+        # Packet must include IP protocol to get TCP
+        if not ip or isinstance(ip, bytes):
+            return
+
+        # Skip packets that are not TCP
+        tcp = ip.data
+        if type(tcp) != dpkt.tcp.TCP:
+            return
+
+        # Grab all flags in this TCP packet
+        tcp_flags = TcpPacket(tcp).return_flags()
+
+        # Hosts are keyed by integers, as in the fast decoder
+        source_ip = int.from_bytes(ip.src, 'big')
+        destination_ip = int.from_bytes(ip.dst, 'big')
+        if len(ip.src) == 16:
+            source_ip |= IPV6_KEY
+            destination_ip |= IPV6_KEY
+
+        # Fingerprint possible suspects. Full counts are kept for every
+        # host, the ratio is only evaluated when suspects are requested
+        if {'SYN'} == set(tcp_flags):          # A 'SYN' request.
+            self.host_counts.add(source_ip, 1, 0)
+        elif {'SYN', 'ACK'} == set(tcp_flags): # A 'SYN-ACK' reply.
+            self.host_counts.add(destination_ip, 0, 1)
+
+    @property
+    def suspect_ips(self):
+        """
+        Return hosts that sent at least ratio times more SYNs than the SYN-ACKs they received.
+        """
+        return {format_ip(ip): {'SYN': syn, 'SYN-ACK': syn_ack}
+                for ip, (syn, syn_ack) in self.host_counts.items()
+                if syn >= syn_ack * self.ratio}
     
     def print_results(self):
         print("Analyzed {} packets...".format(self.packet_count))
 
-        if not self.suspect_ips:
+        suspect_ips = self.suspect_ips
+        if not suspect_ips:
             print("No suspicious packets found")
 
-        for suspect_ip in self.suspect_ips.keys():
+        for suspect_ip in suspect_ips.keys():
             print("{:15} had {} SYNs and {} SYN-ACKs".format(suspect_ip, 
-                                                            self.suspect_ips[suspect_ip]["SYN"],
-                                                            self.suspect_ips[suspect_ip]["SYN-ACK"]))
+                                                            suspect_ips[suspect_ip]["SYN"],
+                                                            suspect_ips[suspect_ip]["SYN-ACK"]))
+
+class StreamAnalyzer:
+    """
+    Scan detection over a live pcap stream, e.g. tcpdump -w - piped to stdin
+    or a FIFO. SYNs and SYN-ACKs are counted per host in a sliding window of
+    time buckets, and a host is reported as soon as its window counts cross
+    the ratio. Hosts idle for a whole window are evicted, and at most
+    max_hosts are tracked (least recently active first out), so memory
+    stays capped during spoofed-source floods.
+    """
+    def __init__(self, stream, ratio, window=60.0, buckets=6, max_hosts=100000, min_syns=20, output=None):
+        self.stream = stream
+        self.ratio = float(ratio)
+        self.window = float(window)
+        self.buckets = buckets
+        self.bucket_width = self.window / buckets
+        self.max_hosts = max_hosts
+        self.min_syns = min_syns
+        self.output = output or sys.stdout
+
+        # host -> [last bucket, SYN ring, SYN-ACK ring, SYNs, SYN-ACKs, alert bucket]
+        self.hosts = OrderedDict()
+        self.packet_count = 0
+        self.alert_count = 0
+
+    def analyze(self):
+        header = self.stream.read(PCAP_HEADER_SIZE)
+        if len(header) < PCAP_HEADER_SIZE or header[:4] not in PCAP_MAGIC:
+            print("Stream is not a classic libpcap capture")
+            return
+        endian = PCAP_MAGIC[header[:4]]
+        subsecond = 1e-9 if header[:4] in PCAP_NANOSECOND_MAGIC else 1e-6
+        linktype = struct.unpack_from(endian + 'I', header, 20)[0] & 0xFFFF
+        record_header = struct.Struct(endian + 'IIII').unpack
+
+        while True:
+            record = self.stream.read(PCAP_RECORD_SIZE)
+            if len(record) < PCAP_RECORD_SIZE:
+                break
+            seconds, fraction, length, _ = record_header(record)
+            buf = self.stream.read(length)
+            if len(buf) < length:
+                break
+            self.packet_count += 1
+
+            flags, ip, version = decode_tcp(buf, 0, length, linktype)
+            if flags == TCP_SYN:
+                self.count(host_keys(buf, ip, version)[0], 1, seconds + fraction * subsecond)
+            elif flags == TCP_SYN_ACK:
+                self.count(host_keys(buf, ip, version)[1], 2, seconds + fraction * subsecond)
+
+        print("Analyzed {} packets, raised {} alerts".format(self.packet_count, self.alert_count), file=self.output)
+
+    def count(self, ip, kind, timestamp):
+        """
+        Add a SYN (kind 1) or SYN-ACK (kind 2) for a host at a capture time
+        and raise an alert if the host crosses the ratio within the window.
+        """
+        bucket = int(timestamp // self.bucket_width)
+        host = self.hosts.get(ip)
+        if host is None:
+            host = [bucket, [0] * self.buckets, [0] * self.buckets, 0, 0, None]
+            self.hosts[ip] = host
+        else:
+            self.hosts.move_to_end(ip)
+            self.advance(host, bucket)
+
+        slot = bucket % self.buckets
+        if kind == 1:
+            host[1][slot] += 1
+            host[3] += 1
+        else:
+            host[2][slot] += 1
+            host[4] += 1
+
+        # Alert at most once per window for each host
+        if host[3] >= self.min_syns and host[3] >= host[4] * self.ratio \
+                and (host[5] is None or bucket - host[5] >= self.buckets):
+            host[5] = bucket
+            self.alert(ip, host, timestamp)
+
+        self.evict(bucket)
+
+    def advance(self, host, bucket):
+        """
+        Slide a host's window forward to bucket, dropping expired buckets.
+        """
+        expired = min(bucket - host[0], self.buckets)
+        for step in range(1, expired + 1):
+            slot = (host[0] + step) % self.buckets
+            host[3] -= host[1][slot]
+            host[4] -= host[2][slot]
+            host[1][slot] = host[2][slot] = 0
+        host[0] = max(host[0], bucket)
+
+    def evict(self, bucket):
+        """
+        Drop hosts idle for a whole window, then the least recently active
+        hosts beyond max_hosts.
+        """
+        hosts = self.hosts
+        while hosts:
+            host = next(iter(hosts.values()))
+            if bucket - host[0] < self.buckets and len(hosts) <= self.max_hosts:
+                break
+            hosts.popitem(last=False)
+
+    def alert(self, ip, host, timestamp):
+        self.alert_count += 1
+        print("{} ALERT {:15} sent {} SYNs and received {} SYN-ACKs in the last {:g}s".format(
+            time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)), format_ip(ip),
+            host[3], host[4], self.window), file=self.output, flush=True)
 
 def main():
     # Set-up command line options
     parser = argparse.ArgumentParser(description="Simple port scan detection script")
-    parser.add_argument("-f", "--file", help="Target PCAP file", required=True)
+    parser.add_argument("-f", "--file", help="Target PCAP file(s), analyzed as one capture", nargs='+', required=True)
     parser.add_argument("-r", "--ratio", help="Ratio of SYN packets sent vs SYN-ACK received", type=int, default=3, required=False)
+    parser.add_argument("--fast", help="Decode packet headers directly from the memory-mapped capture", action='store_true')
+    parser.add_argument("-w", "--workers", help="Number of processes sharing the analysis", type=int, default=1)
+    parser.add_argument("-c", "--compact", help="Track hosts in a compact array-backed table to save memory", action='store_true')
+    parser.add_argument("-s", "--stream", help="Read a live pcap stream from the file or FIFO (- for stdin) and alert as scans happen", action='store_true')
+    parser.add_argument("--window", help="Sliding window in seconds used by --stream", type=float, default=60.0)
+    parser.add_argument("--max-hosts", help="Maximum number of hosts tracked by --stream", type=int, default=100000)
+    parser.add_argument("--min-syns", help="Minimum SYNs in the window before --stream raises an alert", type=int, default=20)
     args = parser.parse_args()
 
-    print("Running analysis on PCAP file: {}".format(args.file))
+    if args.stream:
+        source = args.file[0]
+        stream = sys.stdin.buffer if source == '-' else open(source, 'rb')
+        print("Streaming analysis of: {}".format(source))
+        print("Selected ratio: {}".format(args.ratio))
+        StreamAnalyzer(stream, args.ratio, args.window, max_hosts=args.max_hosts, min_syns=args.min_syns).analyze()
+        return
+
+    print("Running analysis on PCAP file: {}".format(", ".join(args.file)))
     print("Selected ratio: {}".format(args.ratio))
-    PacketAnalyzer(args.file, args.ratio).analyze()
+    PacketAnalyzer(args.file, args.ratio, fast=args.fast, workers=args.workers, compact=args.compact).analyze()
 
 
 if __name__ == "__main__":
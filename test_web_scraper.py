@@ -0,0 +1,300 @@
+"""
+Tests of the web scraper download engine against a local HTTP stand-in
+for virusshare.com. Run with python -m pytest or python -m unittest.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from web_scraper import AsyncDownloadEngine, WebScraper
+
+HEADER = b''.join(b'# VirusShare header line %d\n' % line for line in range(6))
+
+
+def hash_file(number, hashes=2000):
+    """Returns the content of a synthetic VirusShare hash file"""
+    return HEADER + b''.join(hashlib.md5(b'%d-%d' % (number, i)).hexdigest().encode() + b'\n'
+                             for i in range(hashes))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves the hash file index and hash files of a StandInServer,
+       with ETag, Last-Modified, If-None-Match and Range/If-Range support"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            server.requests.append((time.monotonic(), self.path, dict(self.headers)))
+        try:
+            time.sleep(server.delay)
+            self.respond()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self):
+        server = self.server
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/hashes')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/hashes':
+            body = b'<html><table><tr><td><p>' + b''.join(
+                b'<a href="%s">%s</a>' % (path[1:].encode(), path[1:].encode()) for path in sorted(server.files)
+            ) + b'</p></td></tr></table></html>'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        last_modified = 'Mon, 01 Jan 2024 00:00:00 GMT'
+        if self.headers.get('If-None-Match') == etag:
+            server.responses.append((self.path, 304))
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start = 0
+        requested = self.headers.get('Range')
+        if requested and self.headers.get('If-Range') == etag:
+            start = int(requested.split('=')[1].split('-')[0])
+        part = body[start:]
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body) - 1, len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Content-Length', str(len(part)))
+        self.end_headers()
+
+        cut = server.cuts.pop(self.path, None)
+        if cut is not None:
+            # Drop the connection part way through the body
+            server.responses.append((self.path, 'cut'))
+            self.wfile.write(part[:cut])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        server.responses.append((self.path, 206 if start else 200))
+        self.wfile.write(part)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Local stand-in for virusshare.com recording connections and requests"""
+    daemon_threads = True
+
+    def __init__(self, files, delay=0.0):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.files = files
+        self.delay = delay
+        self.cuts = {}
+        self.lock = threading.Lock()
+        self.reset()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def reset(self):
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+        self.responses = []
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_port, path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInTestCase(unittest.TestCase):
+    files = 10
+    delay = 0.0
+
+    def setUp(self):
+        files = {'/hashfiles/VirusShare_%05d.md5' % number: hash_file(number) for number in range(self.files)}
+        self.server = StandInServer(files, self.delay)
+        self.directory = tempfile.TemporaryDirectory()
+        self.scraper = WebScraper(self.server.url('/hashes'), self.directory.name)
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def stored(self, path):
+        with open(self.scraper.hash_file_name(self.server.url(path)), 'rb') as file:
+            return file.read()
+
+    def assert_stored_files_match(self):
+        for path, body in self.server.files.items():
+            self.assertEqual(self.stored(path), body[len(HEADER):])
+
+
+class AsyncDownloadEngineTest(StandInTestCase):
+    delay = 0.02
+
+    def fetch_all(self, engine):
+        urls = [self.server.url(path) for path in sorted(self.server.files)]
+        bodies = {}
+
+        async def fetch(engine, url):
+            async with engine.request(url) as response:
+                bodies[url] = await response.read()
+
+        engine.hash_file_urls = urls
+        engine.run_tasks(fetch)
+        return bodies
+
+    def test_keep_alive_connections_are_reused(self):
+        bodies = self.fetch_all(AsyncDownloadEngine(max_connections=8, connections_per_host=2))
+        self.assertEqual(len(bodies), self.files)
+        for path, body in self.server.files.items():
+            self.assertEqual(bodies[self.server.url(path)], body)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_connections_per_host_are_bounded(self):
+        self.fetch_all(AsyncDownloadEngine(max_connections=8, connections_per_host=3))
+        self.assertLessEqual(self.server.max_active, 3)
+        self.assertLessEqual(self.server.connections, 3)
+
+    def test_max_connections_bounds_concurrency(self):
+        self.fetch_all(AsyncDownloadEngine(max_connections=1, connections_per_host=4))
+        self.assertEqual(self.server.max_active, 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_requests_are_rate_limited_per_host(self):
+        self.server.delay = 0.0
+        self.fetch_all(AsyncDownloadEngine(max_connections=8, connections_per_host=4, rate_limit=20.0))
+        times = [request[0] for request in self.server.requests]
+        self.assertEqual(len(times), self.files)
+        # Ten requests at 20 per second are spread over at least 9 intervals
+        self.assertGreaterEqual(times[-1] - times[0], 0.4)
+
+    def test_redirects_are_followed(self):
+        async def fetch():
+            engine = AsyncDownloadEngine()
+            try:
+                async with engine.request(self.server.url('/redirect')) as response:
+                    return response.status, await response.read()
+            finally:
+                engine.close()
+
+        status, body = asyncio.run(fetch())
+        self.assertEqual(status, 200)
+        self.assertIn(b'hashfiles/VirusShare_00000.md5', body)
+
+    def test_scrape_writes_hash_files_without_header(self):
+        self.scraper.scrape_malware_hashes(max_connections=4, connections_per_host=2)
+        self.assert_stored_files_match()
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['VirusShare_%05d.txt' % number for number in range(self.files)])
+
+
+class IncrementalSyncTest(StandInTestCase):
+    files = 5
+
+    def sync(self):
+        self.server.reset()
+        self.scraper.scrape_malware_hashes(max_connections=4, connections_per_host=2, incremental=True)
+        return dict(self.server.responses)
+
+    def manifest(self):
+        with open(os.path.join(self.directory.name, 'manifest.json')) as file:
+            return json.load(file)
+
+    def test_first_sync_records_manifest(self):
+        responses = self.sync()
+        self.assertEqual(set(responses.values()), {200})
+        self.assert_stored_files_match()
+        manifest = self.manifest()
+        self.assertEqual(len(manifest), self.files)
+        for path in self.server.files:
+            entry = manifest[os.path.basename(self.scraper.hash_file_name(path))]
+            self.assertTrue(entry['complete'])
+            self.assertEqual(entry['checksum'], hashlib.sha256(self.stored(path)).hexdigest())
+            self.assertEqual(entry['size'], len(self.stored(path)))
+
+    def test_unchanged_files_are_skipped_with_304(self):
+        self.sync()
+        responses = self.sync()
+        self.assertEqual(set(responses.values()), {304})
+        for _, path, headers in self.server.requests:
+            if path != '/hashes':
+                self.assertIn('If-None-Match', headers)
+        # The 304 responses go back to the pool, plus one connection for the index
+        self.assertLessEqual(self.server.connections, 3)
+        self.assert_stored_files_match()
+
+    def test_cut_download_resumes_with_range(self):
+        path = '/hashfiles/VirusShare_00002.md5'
+        cut = 30000
+        self.server.cuts[path] = cut
+        responses = self.sync()
+        self.assertEqual(responses[path], 'cut')
+        name = self.scraper.hash_file_name(path)
+        self.assertFalse(os.path.exists(name))
+        self.assertTrue(os.path.exists(name + '.part'))
+        self.assertFalse(self.manifest()[os.path.basename(name)]['complete'])
+
+        responses = self.sync()
+        self.assertEqual(responses[path], 206)
+        headers = [headers for _, requested, headers in self.server.requests if requested == path][0]
+        self.assertEqual(headers['Range'], 'bytes={}-'.format(cut))
+        self.assertIn('If-Range', headers)
+        self.assertFalse(os.path.exists(name + '.part'))
+        self.assert_stored_files_match()
+        self.assertTrue(self.manifest()[os.path.basename(name)]['complete'])
+
+    def test_upstream_change_is_fetched_in_full(self):
+        self.sync()
+        path = '/hashfiles/VirusShare_00004.md5'
+        self.server.files[path] = hash_file(4, hashes=2500)
+        responses = self.sync()
+        self.assertEqual(responses[path], 200)
+        headers = [headers for _, requested, headers in self.server.requests if requested == path][0]
+        self.assertNotIn('Range', headers)
+        self.assertEqual([status for requested, status in responses.items() if requested != path], [304] * 4)
+        self.assert_stored_files_match()
+
+    def test_new_files_are_fetched(self):
+        self.sync()
+        path = '/hashfiles/VirusShare_00005.md5'
+        self.server.files[path] = hash_file(5)
+        responses = self.sync()
+        self.assertEqual(responses[path], 200)
+        self.assertEqual(sorted(responses.values()), [200] + [304] * 5)
+        self.assert_stored_files_match()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,21 @@ threat intelligence sources.
 """
 
 import logging
-import argparse, os, requests
+import argparse, asyncio, contextlib, hashlib, json, os, re, requests, ssl
 from bs4 import BeautifulSoup
 from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urljoin, urlsplit
+
+# Size of the reads made on response bodies and of the hash file write buffer
+CHUNK_SIZE = 1 << 16
+WRITE_BUFFER_SIZE = 1 << 20
+# Number of comment lines at the top of each VirusShare hash file
+HEADER_LINES = 6
+MANIFEST_NAME = 'manifest.json'
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+([0-9]+)-')
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
 
 class WebScraper:
     """
@@ -18,10 +30,12 @@ class WebScraper:
     Attributes:
         virusshare_url(string):URL for virusshare.com
         directory(string):Folder directory to store data
+        manifest(SyncManifest):State of the files fetched by incremental syncs
     """
-    def __init__(self):
-        self.virusshare_url = "https://virusshare.com/hashes"
-        self.directory = 'ioc_data/'
+    def __init__(self, virusshare_url="https://virusshare.com/hashes", directory='ioc_data/'):
+        self.virusshare_url = virusshare_url
+        self.directory = directory
+        self.manifest = None
 
         # Create directory to store data
         try:
@@ -29,8 +43,15 @@ class WebScraper:
         except FileExistsError:
             pass
 
-    def scrape_malware_hashes(self):
-        """Method to scrape malware MD5 hashes from virusshare.com"""
+    def scrape_malware_hashes(self, max_connections=8, connections_per_host=4, rate_limit=None, incremental=False):
+        """Method to scrape malware MD5 hashes from virusshare.com
+
+           Parameters:
+              max_connections(int): Maximum number of concurrent downloads
+              connections_per_host(int): Maximum number of connections to a single host
+              rate_limit(float): Maximum number of requests per second to a single host, optional
+              incremental(bool): Only fetch files that changed since the last sync
+        """
 
         # Print info message
         print("Starting scrape of {}".format(self.virusshare_url))
@@ -40,6 +61,7 @@ class WebScraper:
             response = requests.get(self.virusshare_url)
         except Exception as e:
             logging.info("Couldn't connect to {}".format(self.virusshare_url))
+            return
 
         # Grab HTML page
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -48,35 +70,247 @@ class WebScraper:
         links = []
         for link in soup.table.p.find_all('a'):
             if "hashfiles/VirusShare" in link.get('href'):
-                links.append('https://virusshare.com/' + link.get('href'))
+                links.append(urljoin(self.virusshare_url, link.get('href')))
+
+        # Scrape hyperlinks concurrently over pooled keep-alive connections
+        engine = AsyncDownloadEngine(links, max_connections, connections_per_host, rate_limit)
+        if incremental:
+            self.manifest = SyncManifest(os.path.join(self.directory, MANIFEST_NAME))
+            engine.run_tasks(self.sync_hash_file)
+        else:
+            engine.run_tasks(self.fetch_hash_file)
 
-        # Scrape hyperlinks concurrently
-        engine = ConcurrencyEngine(len(links), links)
-        engine.run_tasks(self.download_hash_file)
+    def hash_file_name(self, hash_file_url):
+        """Returns the local path of a hash file, which will contain a .txt extension"""
+        return os.path.join(self.directory, os.path.basename(urlsplit(hash_file_url).path).split('.')[0] + ".txt")
 
     def download_hash_file(self, hash_file_url):
         """Method to download individual MD5 hash file from virusshare.com"""
         
-        # Create filename from URL, will contain a .txt extension
-        filename = self.directory + hash_file_url.split('/')[4].split('.')[0]+".txt"
-
-        # Scrape data
+        # Stream data to disk
         try:
-            hashes = requests.get(hash_file_url).text.split('\n')[6:]
+            with requests.get(hash_file_url, stream=True) as response:
+                response.raise_for_status()
+                with HashFileWriter(self.hash_file_name(hash_file_url)) as writer:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        writer.write(chunk)
         
         except Exception:
             logging.info("Failed to download data from {}".format(hash_file_url))
-            pass
+            return
 
-        # Create file for writing
-        with open(filename, "a+") as file:
-            
-            # Scrape hash values, remove header and write to file
-            for hash in hashes:
-                file.write(hash + "\n")
+        # Print message
+        logging.info("Scraped {} hashes from {}".format(writer.hashes, hash_file_url))
+
+    async def fetch_hash_file(self, engine, hash_file_url):
+        """Coroutine to download an individual MD5 hash file through an AsyncDownloadEngine"""
+
+        # Stream data to disk
+        try:
+            async with engine.request(hash_file_url) as response:
+                if response.status != 200:
+                    logging.info("Failed to download data from {} (HTTP {})".format(hash_file_url, response.status))
+                    return
+                with HashFileWriter(self.hash_file_name(hash_file_url)) as writer:
+                    async for chunk in response.iter_chunks():
+                        writer.write(chunk)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            logging.info("Failed to download data from {}".format(hash_file_url))
+            return
 
         # Print message
-        logging.info("Scraped {} hashes from {}".format(len(hashes), hash_file_url))
+        logging.info("Scraped {} hashes from {}".format(writer.hashes, hash_file_url))
+
+    async def sync_hash_file(self, engine, hash_file_url):
+        """Coroutine to download a hash file only if it changed since the last sync
+
+           Unchanged files are skipped with a conditional request on
+           the ETag and Last-Modified recorded in the manifest, and an
+           interrupted download resumes from its .part file with a
+           Range request, guarded by If-Range.
+        """
+        filename = self.hash_file_name(hash_file_url)
+        name = os.path.basename(filename)
+        entry = self.manifest.get(name)
+        etag = entry.get('etag')
+        validator = etag if etag and not etag.startswith('W/') else entry.get('last_modified')
+
+        headers = {}
+        offset = None
+        if entry.get('complete') and os.path.exists(filename) and os.path.getsize(filename) == entry.get('size'):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        elif not entry.get('complete') and entry.get('header_size') is not None and validator \
+                and os.path.exists(filename + '.part'):
+            offset = entry['header_size'] + os.path.getsize(filename + '.part')
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = validator
+
+        writer = None
+        try:
+            async with engine.request(hash_file_url, headers) as response:
+                if response.status == 304:
+                    logging.info("{} is up to date".format(hash_file_url))
+                    return
+                content_range = CONTENT_RANGE_PATTERN.match(response.headers.get('content-range', ''))
+                resumed = response.status == 206 and content_range is not None and int(content_range.group(1)) == offset
+                if response.status != 200 and not resumed:
+                    logging.info("Failed to download data from {} (HTTP {})".format(hash_file_url, response.status))
+                    return
+
+                entry = {'url': hash_file_url, 'etag': response.headers.get('etag'),
+                         'last_modified': response.headers.get('last-modified'),
+                         'header_size': entry['header_size'] if resumed else None, 'complete': False}
+                writer = HashFileWriter(filename, resume=resumed, keep_partial=True)
+                async for chunk in response.iter_chunks():
+                    writer.write(chunk)
+                writer.commit()
+                if not resumed:
+                    entry['header_size'] = writer.header_size
+                entry.update(size=writer.size, checksum=writer.checksum, complete=True)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            logging.info("Failed to download data from {}".format(hash_file_url))
+        finally:
+            if writer is not None:
+                if not entry['complete']:
+                    # Keep what was received so the next sync can resume
+                    writer.abort()
+                    if not resumed:
+                        entry['header_size'] = writer.header_size if writer.header_lines == 0 else None
+                self.manifest.update(name, entry)
+
+        if writer is not None and entry['complete']:
+            logging.info("Scraped {} hashes from {}{}".format(
+                writer.hashes, hash_file_url, " (resumed at byte {})".format(offset) if resumed else ""))
+
+
+class SyncManifest:
+    """
+    JSON manifest of the hash files fetched by incremental syncs
+
+    Each entry records the source URL, the ETag and Last-Modified
+    validators, the stored size and SHA-256 checksum, and whether the
+    download completed. The manifest is written back atomically after
+    every update.
+
+    Attributes:
+        manifest_path(string): Path of the JSON manifest
+        entries(dict): Maps hash file names to their entry
+    """
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.entries = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                self.entries = json.load(file)
+
+    def get(self, name):
+        return self.entries.get(name, {})
+
+    def update(self, name, entry):
+        """Records the entry of a hash file and saves the manifest"""
+        self.entries[name] = entry
+        self.save()
+
+    def save(self):
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.entries, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
+
+
+class HashFileWriter:
+    """
+    Writes a hash file to disk as it is downloaded, skipping its header
+
+    Chunks go through a large write buffer into a temporary file, which
+    atomically replaces the destination once the download completes, so
+    memory use stays flat and an interrupted or repeated download never
+    leaves a partial or duplicated hash file behind.
+
+    Attributes:
+        filename(string): Destination path of the hash file
+        temp_path(string): Path of the file being written
+        header_lines(int): Number of header lines still to skip
+        header_size(int): Number of header bytes skipped
+        hashes(int): Number of hash lines written
+        size(int): Number of bytes written
+        keep_partial(bool): Whether abort() keeps the temporary file for a later resume
+    """
+    def __init__(self, filename, header_lines=HEADER_LINES, buffer_size=WRITE_BUFFER_SIZE,
+                 resume=False, keep_partial=False):
+        self.filename = filename
+        self.temp_path = filename + '.part'
+        self.header_lines = header_lines
+        self.header_size = 0
+        self.hashes = 0
+        self.size = 0
+        self.keep_partial = keep_partial
+        self._last = b'\n'
+        self._digest = hashlib.sha256()
+
+        # A resumed download appends to the data already received
+        if resume and os.path.exists(self.temp_path):
+            self.header_lines = 0
+            with open(self.temp_path, 'rb') as file:
+                for block in iter(lambda: file.read(WRITE_BUFFER_SIZE), b''):
+                    self._update(block)
+            self._file = open(self.temp_path, 'ab', buffering=buffer_size)
+        else:
+            self._file = open(self.temp_path, 'wb', buffering=buffer_size)
+
+    @property
+    def checksum(self):
+        """SHA-256 hex digest of the data written so far"""
+        return self._digest.hexdigest()
+
+    def _update(self, chunk):
+        self._digest.update(chunk)
+        self.size += len(chunk)
+        self.hashes += chunk.count(b'\n')
+        self._last = chunk[-1:]
+
+    def write(self, chunk):
+        """Writes a chunk of the download, minus any header lines it holds"""
+        start = 0
+        while self.header_lines:
+            newline = chunk.find(b'\n', start)
+            if newline == -1:
+                self.header_size += len(chunk) - start
+                return
+            self.header_lines -= 1
+            self.header_size += newline + 1 - start
+            start = newline + 1
+        if start:
+            chunk = chunk[start:]
+        if chunk:
+            self._file.write(chunk)
+            self._update(chunk)
+
+    def commit(self):
+        """Completes the last line and moves the file into place"""
+        if self._last != b'\n':
+            self._file.write(b'\n')
+            self._update(b'\n')
+        self._file.close()
+        os.replace(self.temp_path, self.filename)
+
+    def abort(self):
+        """Discards the partially written file, unless keep_partial is set"""
+        self._file.close()
+        if not self.keep_partial:
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
 
 
 class ConcurrencyEngine:
@@ -100,6 +334,281 @@ class ConcurrencyEngine:
                 logging.info("Scrape complete")
                 pass
 
+class HttpResponse:
+    """
+    HTTP/1.1 response whose body is streamed from a pooled connection
+
+    Attributes:
+        url(string): URL of the response, after redirects
+        status(int): HTTP status code
+        reason(string): HTTP reason phrase
+        headers(dict): Response headers, with lower-case names
+        complete(bool): Whether the body was read to the end
+    """
+    def __init__(self, url, status, reason, headers, connection, pool, method, timeout):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.complete = False
+        self._connection = connection
+        self._pool = pool
+        self._timeout = timeout
+
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self._length = 0
+        elif self._chunked:
+            self._length = None
+        else:
+            length = headers.get('content-length')
+            self._length = int(length) if length is not None and length.strip().isdigit() else None
+        # A response without a body is complete as soon as its head is read
+        self.complete = self._length == 0
+
+    async def _read(self, awaitable):
+        return await asyncio.wait_for(awaitable, self._timeout)
+
+    async def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """Asynchronously yields the body in chunks of at most chunk_size bytes"""
+        reader = self._connection[0]
+        if self._chunked:
+            while True:
+                size_line = await self._read(reader.readline())
+                if not size_line:
+                    raise ConnectionError("response body truncated")
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip the trailer section
+                    while (await self._read(reader.readline())) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                while size:
+                    data = await self._read(reader.read(min(size, chunk_size)))
+                    if not data:
+                        raise ConnectionError("response body truncated")
+                    size -= len(data)
+                    yield data
+                await self._read(reader.readexactly(2))
+        elif self._length is not None:
+            remaining = self._length
+            while remaining:
+                data = await self._read(reader.read(min(remaining, chunk_size)))
+                if not data:
+                    raise ConnectionError("response body truncated")
+                remaining -= len(data)
+                yield data
+        else:
+            # Without a length the body ends when the server closes the connection
+            while True:
+                data = await self._read(reader.read(chunk_size))
+                if not data:
+                    break
+                yield data
+        self.complete = True
+
+    async def read(self):
+        """Returns the whole body as bytes"""
+        return b''.join([chunk async for chunk in self.iter_chunks()])
+
+    def release(self):
+        """Returns the connection to its pool, or closes it if the body
+           was not read to the end or the server asked to close it"""
+        if self._connection is None:
+            return
+        reusable = self.complete and (self._length is not None or self._chunked)
+        self._pool.release(self._connection, reusable and self.headers.get('connection', '').lower() != 'close')
+        self._connection = None
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections and request rate limit of a single host
+
+    Attributes:
+        scheme(string): URL scheme, http or https
+        host(string): Host name
+        port(int): TCP port
+        interval(float): Minimum number of seconds between two requests
+    """
+    def __init__(self, scheme, host, port, max_connections, rate_limit=None, timeout=60):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.interval = 1.0 / rate_limit if rate_limit else 0.0
+        self.timeout = timeout
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._lock = asyncio.Lock()
+        self._next_request = 0.0
+
+    async def throttle(self):
+        """Waits until the host's rate limit allows another request"""
+        if not self.interval:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_request - now
+            self._next_request = max(now, self._next_request) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def acquire(self):
+        """Returns (connection, reused), reusing an idle connection if there is one"""
+        await self._semaphore.acquire()
+        try:
+            await self.throttle()
+            while self._idle:
+                reader, writer = self._idle.pop()
+                if not writer.is_closing() and not reader.at_eof():
+                    return (reader, writer), True
+                writer.close()
+            context = ssl.create_default_context() if self.scheme == 'https' else None
+            connection = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=context), self.timeout)
+            return connection, False
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def release(self, connection, reusable):
+        """Puts a connection back in the pool, or closes it"""
+        if reusable:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+        self._semaphore.release()
+
+    def close(self):
+        """Closes all idle connections"""
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class AsyncDownloadEngine:
+    """
+    Asyncio download engine reusing keep-alive HTTP/1.1 connections
+
+    Concurrency is bounded globally by max_connections and per host by
+    connections_per_host, and requests to a host can be rate limited.
+
+    Attributes:
+        hash_file_urls(list): URLs processed by run_tasks()
+        max_connections(int): Maximum number of concurrent requests
+        connections_per_host(int): Maximum number of connections to a single host
+        rate_limit(float): Maximum number of requests per second to a single host, optional
+        timeout(float): Timeout in seconds of connecting and of each read
+    """
+    def __init__(self, hash_file_urls=(), max_connections=8, connections_per_host=4, rate_limit=None, timeout=60):
+        self.hash_file_urls = list(hash_file_urls)
+        self.max_connections = max_connections
+        self.connections_per_host = connections_per_host
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self._pools = {}
+        self._semaphore = None
+
+    def run_tasks(self, scrape_task):
+        """Runs the coroutine function scrape_task(engine, url) for every URL"""
+        asyncio.run(self._run_tasks(scrape_task))
+
+    async def _run_tasks(self, scrape_task):
+        try:
+            results = await asyncio.gather(*[scrape_task(self, url) for url in self.hash_file_urls],
+                                           return_exceptions=True)
+            for url, result in zip(self.hash_file_urls, results):
+                if isinstance(result, Exception):
+                    logging.info("Failed to scrape {}: {}".format(url, result))
+            logging.info("Scrape complete")
+        finally:
+            self.close()
+
+    def close(self):
+        """Closes the idle connections of every pool"""
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+    def _get_pool(self, parts):
+        if parts.scheme not in DEFAULT_PORTS:
+            raise ValueError("Unsupported URL scheme: {}".format(parts.scheme))
+        key = (parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+        if key not in self._pools:
+            self._pools[key] = ConnectionPool(*key, self.connections_per_host, self.rate_limit, self.timeout)
+        return self._pools[key]
+
+    @contextlib.asynccontextmanager
+    async def request(self, url, headers=None, method='GET'):
+        """Sends a request and yields its HttpResponse, following redirects
+
+           The connection goes back to its pool when the block exits,
+           if the body was read to the end.
+
+           Parameters:
+              url(str): URL to request
+              headers(dict): Additional request headers, optional
+              method(str): HTTP method
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            for redirect in range(MAX_REDIRECTS + 1):
+                response = await self._send(url, headers or {}, method)
+                location = response.headers.get('location')
+                if response.status not in REDIRECT_STATUSES or not location or redirect == MAX_REDIRECTS:
+                    break
+                try:
+                    await response.read()
+                finally:
+                    response.release()
+                url = urljoin(url, location)
+            try:
+                yield response
+            finally:
+                response.release()
+
+    async def _send(self, url, headers, method):
+        """Writes the request on a pooled connection and reads the response head"""
+        parts = urlsplit(url)
+        pool = self._get_pool(parts)
+        target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        host = parts.netloc.rsplit('@', 1)[-1]
+        head = {'Host': host, 'User-Agent': 'python-playground-scraper',
+                'Accept-Encoding': 'identity', 'Connection': 'keep-alive'}
+        head.update(headers)
+        request = '{} {} HTTP/1.1\r\n{}\r\n'.format(
+            method, target, ''.join('{}: {}\r\n'.format(name, value) for name, value in head.items()))
+
+        # A pooled connection may have been closed by the server while idle,
+        # in which case the request is retried once on a new connection
+        for attempt in range(2):
+            connection, reused = await pool.acquire()
+            reader, writer = connection
+            try:
+                writer.write(request.encode('latin-1'))
+                await writer.drain()
+                while True:
+                    status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                    if not status_line:
+                        raise ConnectionResetError("connection closed by {}".format(host))
+                    version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+                    response_headers = {}
+                    while True:
+                        line = await asyncio.wait_for(reader.readline(), self.timeout)
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        response_headers[name.strip().lower()] = value.strip()
+                    if int(status) != 100:
+                        break
+            except (OSError, asyncio.TimeoutError, ValueError):
+                pool.release(connection, False)
+                if reused and attempt == 0:
+                    continue
+                raise
+            return HttpResponse(url, int(status), reason, response_headers, connection, pool, method, self.timeout)
+
+
 def main():
     """Main program entry point"""
 
@@ -109,13 +618,18 @@ def main():
     # Set up arguments
     parser = argparse.ArgumentParser(description="Simple python parser to rapidly scrape IOCs from public CTI sources")
     parser.add_argument("-m", "--malware_hashes", help="Scrapes virusshare.com for MD5 malware hashes", action='store_true')
+    parser.add_argument("-u", "--url", help="URL of the hash file index", default="https://virusshare.com/hashes")
+    parser.add_argument("-w", "--workers", help="Maximum number of concurrent downloads", type=int, default=8)
+    parser.add_argument("--per-host", help="Maximum number of connections to a single host", type=int, default=4)
+    parser.add_argument("--rate", help="Maximum number of requests per second to a single host", type=float, default=None)
+    parser.add_argument("-s", "--sync", help="Only fetch new or changed hash files and resume interrupted downloads", action='store_true')
 
     # Parse arguments
     args = parser.parse_args()
 
     # Launch scrape
     if args.malware_hashes:
-        WebScraper().scrape_malware_hashes()
+        WebScraper(args.url).scrape_malware_hashes(args.workers, args.per_host, args.rate, args.sync)
     else:
         # Print help menu if no flags are passed
         parser.print_usage()